@@ -0,0 +1,191 @@
+import argparse, asyncio, json, math, os, platform, sys, tempfile, time
+#load generator for the bluetooth client, no esp32 needed
+#
+#publishes synthetic angles into a private angle channel at --rate, runs the real run_client
+#against the fake peripheral in fake_peripheral.py with the given link conditions and reports
+#what got through: messages and bytes per second and the latency from publishing a frame to the
+#fake esp32 applying it. e.g.
+#   python bench_ble_link.py --seconds 10 --latency 0.015 --jitter 0.005 --mtu 23 --loss 0.02
+#   python bench_ble_link.py --response --output with_response.json
+#   python bench_ble_link.py --devices 3     (one fake esp32 per arm, all driven at once)
+#   python bench_ble_link.py --disconnect-every 2 --scan-time 2     (reconnect gaps)
+#   python bench_ble_link.py --protocol ascii --mtu 23     (ascii fallback at the smallest mtu)
+#exits with 1 when frames were published but the fake esp32 applied none of them
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'src_code'))
+BENCH_CHANNEL = 'bap_bench_link_channel'
+BENCH_NOTIFY_PORT = 50598 #keep the doorbell away from a running bluetooth client
+
+import bluetooth_client
+from angle_channel import AngleChannelWriter, arm_channel
+from fake_peripheral import FakePeripheral, FakeScanner, FakeClient
+from latency_trace import percentile
+
+CHANNELS = 12 #index, middle, ring, pinky x (A, B, lat)
+
+def pattern_angles(pattern, t):
+    #angles for every channel at time t
+    if pattern == 'still':
+        return [180, 180, 90] * 4
+    angles = []
+    for channel in range(CHANNELS):
+        lateral = channel % 3 == 2
+        moving = pattern == 'sweep' or channel < 3 #one-finger: only the index finger moves
+        swing = 20 if lateral else 60
+        centre = 90 if lateral else 120
+        angles.append(int(round(centre + (swing * math.sin(2 * math.pi * 0.5 * t + channel) if moving else 0))))
+    return angles
+
+async def publish_angles(writers, pattern, rate, seconds, published):
+    #published: seq -> time.time() it was published, every arm's writer gets the same frames
+    period = 1 / rate
+    start = time.perf_counter()
+    count = 0
+    while time.perf_counter() - start < seconds:
+        now = time.time()
+        angles = pattern_angles(pattern, time.perf_counter() - start)
+        for writer in writers:
+            seq = writer.publish(angles, capture_start=now, capture_time=now, inference_time=now)
+        published[seq & 0xFFFF] = now
+        count += 1
+        await asyncio.sleep(max(0.0, start + count * period - time.perf_counter()))
+    return count
+
+async def drop_links(peripherals, every):
+    #the esp32s drop the link every so often, the client should come straight back
+    while True:
+        await asyncio.sleep(every)
+        for peripheral in peripherals:
+            peripheral.disconnect()
+
+async def run_load(args):
+    bluetooth_client.PROTOCOL = args.protocol
+    bluetooth_client.WRITE_WITH_RESPONSE = args.response
+    bluetooth_client.SEND_RATE_HZ = args.send_rate
+    bluetooth_client.DELTA_UPDATES = not args.no_delta
+    bluetooth_client.TRACE_LATENCY = args.protocol == 'binary' #trace ids tie applied frames back to when they were published
+    bluetooth_client.STATS_INTERVAL = args.seconds + 60 #only the final report
+    bluetooth_client.ADDRESS_CACHE = os.path.join(tempfile.mkdtemp(), 'ble_devices.json') #first connect scans
+
+    #one fake esp32 per arm, a single device keeps the real name and goes through run_client
+    peripherals = [FakePeripheral(latency=args.latency, jitter=args.jitter, mtu=args.mtu, loss=args.loss,
+                                  name=bluetooth_client.SERVER_NAME if args.devices == 1 else f'BAP bench {arm}',
+                                  seed=args.seed + arm)
+                   for arm in range(args.devices)]
+    published = {}
+    latencies = []
+    def on_frame(seq, channels, angles, trace_id, applied):
+        if trace_id in published:
+            latencies.append((applied - published[trace_id]) * 1000)
+    for peripheral in peripherals:
+        peripheral.on_frame = on_frame
+
+    writers = []
+    try:
+        for arm in range(args.devices):
+            name, notify_port = arm_channel(arm, BENCH_CHANNEL, BENCH_NOTIFY_PORT)
+            writers.append(AngleChannelWriter(name=name, notify_port=notify_port))
+        scanner = FakeScanner(*peripherals, scan_time=args.scan_time)
+        metrics = bluetooth_client.ConnectionMetrics()
+        if args.devices == 1:
+            client = bluetooth_client.run_client(scanner, FakeClient, BENCH_CHANNEL, BENCH_NOTIFY_PORT, metrics=metrics)
+        else:
+            devices = [{'name': peripheral.name, 'arm': arm} for arm, peripheral in enumerate(peripherals)]
+            client = bluetooth_client.run_devices(devices, scanner, FakeClient, BENCH_CHANNEL, BENCH_NOTIFY_PORT)
+        client = asyncio.create_task(client)
+        await asyncio.sleep(0.2 + args.scan_time) #connect and attach to the channel
+        start = time.perf_counter()
+        dropper = asyncio.create_task(drop_links(peripherals, args.disconnect_every)) if args.disconnect_every else None
+        frames_published = await publish_angles(writers, args.pattern, args.rate, args.seconds, published)
+        if dropper:
+            dropper.cancel()
+        await asyncio.sleep(max(0.1, 4 * (args.latency + args.jitter))) #let the last packets land
+        elapsed = time.perf_counter() - start
+        for peripheral in peripherals:
+            peripheral.shutdown()
+        await asyncio.wait_for(client, timeout=5)
+    finally:
+        for writer in writers:
+            writer.close()
+
+    latencies.sort()
+    frames = sum(peripheral.frames for peripheral in peripherals)
+    writes = sum(peripheral.writes for peripheral in peripherals)
+    sent_bytes = sum(peripheral.bytes for peripheral in peripherals)
+    return {
+        'seconds': elapsed,
+        'devices': args.devices,
+        'published': frames_published,
+        'messages': frames,
+        'writes': writes,
+        'bytes': sent_bytes,
+        'lost_writes': sum(peripheral.lost for peripheral in peripherals),
+        'bad_frames': sum(peripheral.bad for peripheral in peripherals),
+        'messages_per_s': frames / elapsed,
+        'writes_per_s': writes / elapsed,
+        'bytes_per_s': sent_bytes / elapsed,
+        'messages_per_s_per_device': [peripheral.frames / elapsed for peripheral in peripherals],
+        'scans': scanner.scans,
+        'reconnects': metrics.reconnects,
+        'reconnect_gaps_s': metrics.gaps,
+        'latency_ms': {'count': len(latencies), 'p50': percentile(latencies, 0.50),
+                       'p95': percentile(latencies, 0.95), 'p99': percentile(latencies, 0.99)},
+    }
+
+def print_results(results):
+    latency = results['latency_ms']
+    print(f"\n{results['published']} frames published to {results['devices']} arm(s), {results['messages']} applied by the fake esp32s "
+          f"in {results['writes']} writes ({results['lost_writes']} lost, {results['bad_frames']} bad)")
+    print(f"{results['messages_per_s']:10.1f} messages/s")
+    print(f"{results['writes_per_s']:10.1f} writes/s")
+    print(f"{results['bytes_per_s']:10.1f} bytes/s")
+    if results['devices'] > 1:
+        print('messages/s per device: ' + ', '.join(f'{rate:.1f}' for rate in results['messages_per_s_per_device']))
+    if results['reconnects']:
+        gaps = results['reconnect_gaps_s']
+        print(f"{results['reconnects']} reconnects, gap avg {1000 * sum(gaps) / len(gaps):.0f} ms "
+              f"max {1000 * max(gaps):.0f} ms, {results['scans']} scan(s)")
+    if latency['count']:
+        print(f"latency publish -> applied, ms p50 / p95 / p99: "
+              f"{latency['p50']:.1f} / {latency['p95']:.1f} / {latency['p99']:.1f}  ({latency['count']} frames)")
+
+def main():
+    parser = argparse.ArgumentParser(description='load test the bluetooth client against a fake esp32')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--rate', type=float, default=60, help='angle frames published per second')
+    parser.add_argument('--devices', type=int, default=1, help='fake esp32s, one per arm')
+    parser.add_argument('--pattern', choices=['sweep', 'one-finger', 'still'], default='sweep')
+    parser.add_argument('--send-rate', type=float, default=bluetooth_client.SEND_RATE_HZ, help='client send rate cap (Hz)')
+    parser.add_argument('--protocol', choices=['binary', 'ascii'], default=bluetooth_client.PROTOCOL)
+    parser.add_argument('--response', action='store_true', help='write with response')
+    parser.add_argument('--no-delta', action='store_true', help='send every channel instead of delta updates')
+    parser.add_argument('--latency', type=float, default=0.0075, help='one way link latency (s)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='extra random latency up to this (s)')
+    parser.add_argument('--mtu', type=int, default=247)
+    parser.add_argument('--loss', type=float, default=0.0, help='chance a write without response is lost')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--scan-time', type=float, default=0.0, help='seconds a scan takes to find the device')
+    parser.add_argument('--disconnect-every', type=float, default=0.0, help='drop the link every this many seconds')
+    parser.add_argument('--output', help='write the results to this json file')
+    args = parser.parse_args()
+
+    results = asyncio.run(run_load(args))
+    print_results(results)
+    link_works = results['messages'] > 0 or not results['published']
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({
+                'meta': {
+                    'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'python': platform.python_version(),
+                    'platform': platform.platform(),
+                    'args': vars(args),
+                },
+                'results': results,
+            }, file, indent=2)
+        print(f"\nResults written to {args.output}")
+    return 0 if link_works else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
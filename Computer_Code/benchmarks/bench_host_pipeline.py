@@ -0,0 +1,243 @@
+import argparse, json, os, platform, sys, tempfile, time
+import numpy as np
+#benchmarks for the host side hot path, no camera or esp32 needed
+#
+#runs the angle math, fusion, angle publishing and packet parsing over the landmark fixtures
+#in data/fixtures and prints per call latency and throughput. --output saves the results as
+#json and --compare checks them against a saved run, e.g.
+#   python bench_host_pipeline.py --output before.json
+#   python bench_host_pipeline.py --compare before.json
+#
+#add new variants with the @benchmark decorator, each one returns a function that does one
+#call and the number of calls to make per round
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'src_code'))
+DEFAULT_FIXTURE = os.path.join(BENCH_DIR, '..', 'data', 'fixtures', 'hand_open_close.json')
+BENCH_CHANNEL = 'bap_bench_channel'
+BENCH_NOTIFY_PORT = 50599 #keep the doorbell away from a running bluetooth client
+
+import hand_tracking
+import bluetooth_client
+import angle_protocol
+from angle_channel import AngleChannelWriter
+from mediapipe.framework.formats import landmark_pb2
+
+BENCHMARKS = {}
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+#-----------------------------------------------------------------------------------#
+#                                    Fixtures
+#
+#-----------------------------------------------------------------------------------#
+class Fixture:
+    def __init__(self, path):
+        with open(path) as file:
+            data = json.load(file)
+        self.path = path
+        self.points = np.array([frame['landmarks'] for frame in data['frames']], dtype=np.float64)
+        self.hand_types = [frame['handedness'] for frame in data['frames']]
+        #same landmark objects mediapipe hands gives back
+        self.landmarks = [[landmark_pb2.NormalizedLandmark(x=x, y=y, z=z) for x, y, z in frame]
+                          for frame in self.points.tolist()]
+        self.front_angles = hand_tracking.calculate_finger_angles_batch(self.points, self.hand_types)
+        self.back_angles = hand_tracking.calculate_finger_angles_batch(self.points, self.hand_types, is_back_camera=True)
+        self.angle_lists = [[value for finger, angles in frame.items() if finger != 'Thumb'
+                             for value in (angles['A'], angles['B'], angles['lat'])]
+                            for frame in self.front_angles]
+
+    def __len__(self):
+        return len(self.points)
+
+def cycle(items):
+    index = 0
+    def next_item():
+        nonlocal index
+        item = items[index]
+        index = (index + 1) % len(items)
+        return item
+    return next_item
+
+#-----------------------------------------------------------------------------------#
+#                                   Benchmarks
+#
+#-----------------------------------------------------------------------------------#
+@benchmark('calculate_finger_angles')
+def bench_calculate_finger_angles(fixture):
+    frames = cycle(list(zip(fixture.landmarks, fixture.hand_types)))
+    def run():
+        landmarks, hand_type = frames()
+        hand_tracking.calculate_finger_angles(landmarks, hand_type)
+    return run, len(fixture)
+
+@benchmark('calculate_finger_angles_back')
+def bench_calculate_finger_angles_back(fixture):
+    frames = cycle(list(zip(fixture.landmarks, fixture.hand_types)))
+    def run():
+        landmarks, hand_type = frames()
+        hand_tracking.calculate_finger_angles(landmarks, hand_type, is_back_camera=True)
+    return run, len(fixture)
+
+@benchmark('calculate_finger_angles_batch')
+def bench_calculate_finger_angles_batch(fixture):
+    #one call is the whole sequence, throughput is in sequences
+    def run():
+        hand_tracking.calculate_finger_angles_batch(fixture.points, fixture.hand_types)
+    return run, 20
+
+@benchmark('calculate_lateral_angle')
+def bench_calculate_lateral_angle(fixture):
+    joints = cycle([(frame[index], frame[base], hand_type)
+                    for frame, hand_type in zip(fixture.landmarks, fixture.hand_types)
+                    for _, _, index, base in hand_tracking.finger_dictionary.values()])
+    def run():
+        pip, base, hand_type = joints()
+        hand_tracking.calculate_lateral_angle(pip, base, hand_type)
+    return run, len(fixture) * 5
+
+@benchmark('fuse_angles')
+def bench_fuse_angles(fixture):
+    pairs = cycle(list(zip(fixture.front_angles, fixture.back_angles)))
+    def run():
+        front, back = pairs()
+        hand_tracking.fuse_angles(front, back)
+    return run, len(fixture)
+
+@benchmark('write_angles')
+def bench_write_angles(fixture):
+    #publishes into a private channel and writes the validation file to a temp dir
+    temp_dir = tempfile.mkdtemp()
+    hand_tracking.validation_file = os.path.join(temp_dir, 'dictionary.txt')
+    hand_tracking.close_angle_channel()
+    hand_tracking.angle_channel = AngleChannelWriter(name=BENCH_CHANNEL, notify_port=BENCH_NOTIFY_PORT)
+    frames = cycle(fixture.front_angles)
+    def run():
+        hand_tracking.write_angles(frames())
+    return run, len(fixture)
+
+@benchmark('parse_data')
+def bench_parse_data(fixture):
+    messages = cycle([','.join(map(str, angle_list)) for angle_list in fixture.angle_lists])
+    def run():
+        bluetooth_client.parse_data(messages())
+    return run, len(fixture)
+
+@benchmark('encode_frame')
+def bench_encode_frame(fixture):
+    angle_lists = cycle(fixture.angle_lists)
+    def run():
+        angle_protocol.encode_frame(angle_lists(), 0)
+    return run, len(fixture)
+
+@benchmark('decode_frame')
+def bench_decode_frame(fixture):
+    frames = cycle([angle_protocol.encode_frame(angle_list, 0) for angle_list in fixture.angle_lists])
+    def run():
+        angle_protocol.decode_frame(frames())
+    return run, len(fixture)
+
+#-----------------------------------------------------------------------------------#
+#                                     Runner
+#
+#-----------------------------------------------------------------------------------#
+def measure(run, calls, rounds, warmup=1):
+    for _ in range(warmup * calls):
+        run()
+    per_call_ns = []
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for _ in range(calls):
+            call_start = time.perf_counter_ns()
+            run()
+            per_call_ns.append(time.perf_counter_ns() - call_start)
+    total = time.perf_counter() - start
+    per_call_us = np.array(per_call_ns) / 1000
+    return {
+        'calls': len(per_call_ns),
+        'total_s': total,
+        'throughput_per_s': len(per_call_ns) / total,
+        'mean_us': float(per_call_us.mean()),
+        'p50_us': float(np.percentile(per_call_us, 50)),
+        'p95_us': float(np.percentile(per_call_us, 95)),
+        'p99_us': float(np.percentile(per_call_us, 99)),
+    }
+
+def run_benchmarks(fixture, names, rounds):
+    results = {}
+    try:
+        for name in names:
+            run, calls = BENCHMARKS[name](fixture)
+            results[name] = measure(run, calls, rounds)
+            result = results[name]
+            print(f"{name:<32}{result['mean_us']:10.2f} us/call  p95 {result['p95_us']:10.2f} us  "
+                  f"{result['throughput_per_s']:12.0f} calls/s")
+    finally:
+        hand_tracking.close_angle_channel()
+    return results
+
+def compare(results, baseline_path, max_regression):
+    #returns the benchmarks that got slower than max_regression (fraction of the baseline mean)
+    with open(baseline_path) as file:
+        baseline = json.load(file)['results']
+    regressions = []
+    print(f"\nCompared to {baseline_path}:")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['mean_us'] / baseline[name]['mean_us']
+        flag = ''
+        if ratio > 1 + max_regression:
+            regressions.append(name)
+            flag = '  <-- regression'
+        print(f"{name:<32}{ratio:8.2f}x{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the host hand tracking / bluetooth hot path')
+    parser.add_argument('--fixture', default=DEFAULT_FIXTURE)
+    parser.add_argument('--rounds', type=int, default=10, help='passes over the fixture per benchmark')
+    parser.add_argument('--filter', default='', help='only run benchmarks whose name contains this')
+    parser.add_argument('--list', action='store_true', help='list the benchmarks and exit')
+    parser.add_argument('--output', help='write the results to this json file')
+    parser.add_argument('--compare', help='json file from an earlier run to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='fail --compare if a benchmark is this much slower (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    names = [name for name in BENCHMARKS if args.filter in name]
+    if args.list:
+        print('\n'.join(names))
+        return 0
+
+    fixture = Fixture(args.fixture)
+    print(f"{len(fixture)} frames from {fixture.path}, {args.rounds} rounds\n")
+    results = run_benchmarks(fixture, names, args.rounds)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({
+                'meta': {
+                    'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'python': platform.python_version(),
+                    'numpy': np.__version__,
+                    'platform': platform.platform(),
+                    'machine': platform.machine(),
+                    'fixture': os.path.basename(args.fixture),
+                    'frames': len(fixture),
+                    'rounds': args.rounds,
+                },
+                'results': results,
+            }, file, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare and compare(results, args.compare, args.max_regression):
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
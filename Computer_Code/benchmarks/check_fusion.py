@@ -0,0 +1,49 @@
+import json, os, sys
+import numpy as np
+#checks for the stereo fusion in hand_tracking.fuse_angles, no camera needed
+#   python check_fusion.py
+#
+#takes a hand from the landmark fixtures as seen by both cameras and checks that a finger one
+#camera only partly sees (a landmark off the image, so placeholder angles) doesn't pull the
+#fused angles away from what the other camera measured
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'src_code'))
+DEFAULT_FIXTURE = os.path.join(BENCH_DIR, '..', 'data', 'fixtures', 'hand_open_close.json')
+
+import hand_tracking
+
+def camera_angles(points, hand_type, score):
+    angles = hand_tracking.calculate_finger_angles(points, hand_type)
+    return hand_tracking.add_finger_weights(angles, points, score)
+
+def main():
+    with open(DEFAULT_FIXTURE) as file:
+        fixture = json.load(file)
+    frame = fixture['frames'][len(fixture['frames']) // 2]
+    points = np.array(frame['landmarks'], dtype=np.float64)
+    hand_type, score = frame['handedness'], frame['score']
+
+    front = camera_angles(points, hand_type, score)
+    occluded_points = points.copy()
+    tip = hand_tracking.finger_dictionary['Index'][0]
+    occluded_points[tip, 0] = 1.2 #index fingertip off the edge of the back camera's image
+    back = camera_angles(occluded_points, hand_type, score)
+
+    assert back['Index']['weight'] == 0, f"partly seen finger has weight {back['Index']['weight']}"
+    assert front['Index']['weight'] > 0
+    fused = hand_tracking.fuse_angles(front, back, 0.0, 0.01)
+    expected = hand_tracking.strip_weights(front)
+    assert fused['Index'] == expected['Index'], f"fused {fused['Index']}, front camera saw {expected['Index']}"
+    #fingers both cameras see fully (the same here) come out as they went in
+    for finger in ('Middle', 'Ring', 'Pinky'):
+        assert fused[finger] == expected[finger], f'{finger}: {fused[finger]} != {expected[finger]}'
+    #no weight key on any path
+    assert all('weight' not in angle for angle in fused.values())
+    assert all('weight' not in angle for angle in hand_tracking.fuse_angles(front, {}).values())
+
+    print(f"ok: index {fused['Index']} with the back camera's placeholder {hand_tracking.strip_weights(back)['Index']} left out")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
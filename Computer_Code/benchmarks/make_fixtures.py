@@ -0,0 +1,67 @@
+import argparse, json, math, os
+import numpy as np
+#generates the landmark fixtures used by bench_host_pipeline.py
+#
+#the sequences are synthetic: a simple kinematic hand with the mediapipe landmark layout
+#(wrist 0, thumb 1-4, index 5-8, middle 9-12, ring 13-16, pinky 17-20) in normalised image
+#coordinates, opening and closing each finger at its own rate with a bit of sideways spread
+#and jitter. swap in real recordings when we have them
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'fixtures')
+
+#knuckle offsets from the wrist and segment lengths (normalised image units)
+FINGERS = {
+    'Thumb' : ((-0.06, -0.04), (0.05, 0.04, 0.03), -0.9),
+    'Index' : ((-0.04, -0.16), (0.07, 0.045, 0.03), -0.15),
+    'Middle': ((-0.005, -0.17), (0.075, 0.05, 0.032), 0.0),
+    'Ring'  : ((0.03, -0.16), (0.07, 0.045, 0.03), 0.12),
+    'Pinky' : ((0.06, -0.14), (0.055, 0.035, 0.025), 0.28),
+}
+
+def hand_pose(t, rng, wrist=(0.5, 0.8)):
+    points = np.zeros((21, 3))
+    points[0] = (wrist[0], wrist[1], 0.0)
+    index = 1
+    for finger_number, (finger, (knuckle, segments, spread)) in enumerate(FINGERS.items()):
+        curl = 0.5 - 0.5 * math.cos(2 * math.pi * t * (0.4 + 0.1 * finger_number)) #0 open, 1 fist
+        sway = spread + 0.08 * math.sin(2 * math.pi * t * 0.3 + finger_number)
+        if finger == 'Thumb': #thumb base is the cmc joint, closer to the wrist
+            position = np.array([wrist[0] + knuckle[0] * 0.5, wrist[1] + knuckle[1] * 0.5, -0.01])
+        else:
+            position = np.array([wrist[0] + knuckle[0], wrist[1] + knuckle[1], -0.02])
+        points[index] = position
+        index += 1
+
+        bend = 0.0
+        for segment in segments:
+            bend += curl * 1.2 #every joint adds to the curl, bending towards the camera (-z)
+            direction = np.array([math.sin(sway), -math.cos(sway) * math.cos(bend), -math.sin(bend)])
+            position = position + segment * direction
+            points[index] = position
+            index += 1
+
+    points[1:] += rng.normal(0, 0.0015, (20, 3)) #mediapipe jitter
+    return points
+
+def generate(frames, fps, seed):
+    rng = np.random.default_rng(seed)
+    return [{'t': round(i / fps, 4), 'handedness': 'Right', 'score': 0.98,
+             'landmarks': np.round(hand_pose(i / fps, rng), 5).tolist()}
+            for i in range(frames)]
+
+def main():
+    parser = argparse.ArgumentParser(description='generate synthetic landmark fixtures')
+    parser.add_argument('--frames', type=int, default=150)
+    parser.add_argument('--fps', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', default=os.path.join(DATA_DIR, 'hand_open_close.json'))
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w') as file:
+        json.dump({'source': 'synthetic', 'fps': args.fps, 'frames': generate(args.frames, args.fps, args.seed)},
+                  file, separators=(',', ':'))
+    print(f'Wrote {args.frames} frames to {args.output}')
+
+if __name__ == '__main__':
+    main()
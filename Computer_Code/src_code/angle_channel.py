@@ -0,0 +1,216 @@
+import asyncio, socket, struct, time
+from collections import namedtuple
+from multiprocessing import shared_memory
+#angle handoff between hand tracking (producer) and the bluetooth client (consumer)
+#replaces angle_list.txt, the angles live in a shared memory ring buffer of fixed layout
+#records and the producer rings a udp 'doorbell' on localhost after every frame so the
+#consumer can sleep until there is actually something new to read
+
+CHANNEL_NAME = "bap_angle_channel"
+NOTIFY_HOST = "127.0.0.1"
+NOTIFY_PORT = 50507
+SLOT_COUNT = 8
+REATTACH_AFTER = 1.0 #seconds without a new frame before the consumer opens the block again by name
+MAX_VALUES = 16 #one per pca9685 channel
+
+#header: magic, layout version, slot count, producer open flag, latest sequence number
+HEADER_FORMAT = struct.Struct('<4sHHBxxxQ')
+MAGIC = b'BAPA'
+LAYOUT_VERSION = 2
+#slot: sequence number, publish timestamp, camera read start, camera read end, inference done,
+#number of values used, values. the extra times are for latency tracing (see latency_trace.py)
+SLOT_FORMAT = struct.Struct(f'<QddddH{MAX_VALUES}h')
+SEQ_FORMAT = struct.Struct('<Q')
+
+AngleFrame = namedtuple('AngleFrame', ['seq', 'timestamp', 'values', 'capture_start', 'capture_time', 'inference_time'])
+
+def arm_channel(arm, name=CHANNEL_NAME, notify_port=NOTIFY_PORT):
+    #(name, doorbell port) of the channel for one arm when a host drives several, arm 0 is the
+    #plain channel so a single arm setup doesn't change
+    if arm == 0:
+        return name, notify_port
+    return f'{name}_{arm}', notify_port + arm
+
+def channel_size(slots=SLOT_COUNT):
+    return HEADER_FORMAT.size + slots * SLOT_FORMAT.size
+
+def slot_offset(seq, slots):
+    return HEADER_FORMAT.size + (seq % slots) * SLOT_FORMAT.size
+
+#blocks a writer in this process created, the tracker registration is the writer's then
+_created_here = set()
+
+def attach_shared_memory(name):
+    #only the producer owns the block, stop python's resource tracker from unlinking it
+    #when the consumer exits (track was only added in 3.13)
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        if name in _created_here: #same process as the writer (benchmarks), one registration for both
+            return shm
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception:
+            pass
+        return shm
+
+#-----------------------------------------------------------------------------------#
+#                                    Producer
+#
+#-----------------------------------------------------------------------------------#
+class AngleChannelWriter:
+    def __init__(self, name=CHANNEL_NAME, slots=SLOT_COUNT, notify_port=NOTIFY_PORT):
+        self.slots = slots
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=channel_size(slots))
+        except FileExistsError: #left behind by a producer that crashed, take it over
+            self._shm = shared_memory.SharedMemory(name=name)
+            if self._shm.size < channel_size(slots):
+                raise ValueError(f'existing angle channel {name} is too small')
+        _created_here.add(name)
+        self._buf = self._shm.buf
+        self._seq = 0
+        self._notify_address = (NOTIFY_HOST, notify_port)
+        self._notify_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._notify_socket.setblocking(False)
+        HEADER_FORMAT.pack_into(self._buf, 0, MAGIC, LAYOUT_VERSION, slots, 1, 0)
+
+    def publish(self, values, timestamp=None, capture_start=0.0, capture_time=0.0, inference_time=0.0):
+        #the capture/inference times are optional, 0 means not traced
+        values = list(values)[:MAX_VALUES]
+        self._seq += 1
+        seq = self._seq
+        offset = slot_offset(seq, self.slots)
+        padded = values + [0] * (MAX_VALUES - len(values))
+
+        #invalidate the slot first, readers check the slot seq before and after copying
+        SEQ_FORMAT.pack_into(self._buf, offset, 0)
+        SLOT_FORMAT.pack_into(self._buf, offset, 0, time.time() if timestamp is None else timestamp,
+                              capture_start, capture_time, inference_time, len(values), *padded)
+        SEQ_FORMAT.pack_into(self._buf, offset, seq)
+        SEQ_FORMAT.pack_into(self._buf, HEADER_FORMAT.size - SEQ_FORMAT.size, seq)
+
+        try:
+            self._notify_socket.sendto(SEQ_FORMAT.pack(seq), self._notify_address)
+        except OSError: #nobody listening is fine, the frame is still in the buffer
+            pass
+        return seq
+
+    def close(self, unlink=True):
+        try:
+            HEADER_FORMAT.pack_into(self._buf, 0, MAGIC, LAYOUT_VERSION, self.slots, 0, self._seq)
+            self._notify_socket.sendto(SEQ_FORMAT.pack(self._seq), self._notify_address)
+        except Exception:
+            pass
+        self._notify_socket.close()
+        self._buf = None
+        self._shm.close()
+        if unlink:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+
+#-----------------------------------------------------------------------------------#
+#                                    Consumer
+#
+#-----------------------------------------------------------------------------------#
+class AngleChannelReader:
+    def __init__(self, name=CHANNEL_NAME, notify_port=NOTIFY_PORT):
+        self.name = name
+        self._shm = None
+        self._seen_seq = None
+        self._seen_time = 0.0
+        self._notify_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._notify_socket.bind((NOTIFY_HOST, notify_port))
+        self._notify_socket.setblocking(False)
+
+    def _attach(self):
+        if self._shm is not None and time.monotonic() - self._seen_time > REATTACH_AFTER:
+            #nothing new for a while, a producer that crashed and was restarted has a fresh block
+            self._detach()
+        if self._shm is None:
+            try:
+                self._shm = attach_shared_memory(self.name)
+            except FileNotFoundError: #producer hasn't started yet
+                return False
+            self._seen_time = time.monotonic()
+        return True
+
+    def _detach(self):
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+
+    def latest(self):
+        #newest frame, or None if there is no producer or nothing published yet
+        if not self._attach():
+            return None
+        buf = self._shm.buf
+        magic, version, slots, is_open, seq = HEADER_FORMAT.unpack_from(buf, 0)
+        if magic != MAGIC or version != LAYOUT_VERSION:
+            return None
+        if not is_open: #producer closed, drop the mapping so a restarted producer gets picked up
+            self._detach()
+            return None
+        if seq != self._seen_seq:
+            self._seen_seq = seq
+            self._seen_time = time.monotonic()
+        if seq == 0:
+            return None
+
+        offset = slot_offset(seq, slots)
+        for _ in range(3): #retry if the producer lapped us mid copy
+            slot_seq, timestamp, capture_start, capture_time, inference_time, count, *values = SLOT_FORMAT.unpack_from(buf, offset)
+            if slot_seq == seq and SEQ_FORMAT.unpack_from(buf, offset)[0] == seq:
+                return AngleFrame(seq, timestamp, values[:count], capture_start, capture_time, inference_time)
+            seq = HEADER_FORMAT.unpack_from(buf, 0)[4]
+            offset = slot_offset(seq, slots)
+        return None
+
+    def _drain_notifications(self):
+        while True:
+            try:
+                self._notify_socket.recv(64)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError: #windows reports icmp errors from old sends here, ignore them
+                continue
+
+    def wait(self, last_seq=None, timeout=None):
+        #blocking version of wait_for_frame for code outside an event loop
+        frame = self.latest()
+        if frame and frame.seq != last_seq:
+            return frame
+        self._notify_socket.settimeout(timeout)
+        try:
+            self._notify_socket.recv(64)
+        except (socket.timeout, OSError):
+            pass
+        finally:
+            self._notify_socket.setblocking(False)
+        self._drain_notifications()
+        frame = self.latest()
+        return frame if frame and frame.seq != last_seq else None
+
+    async def wait_for_frame(self, last_seq=None, timeout=None):
+        #sleeps until the producer publishes a frame newer than last_seq, None on timeout
+        frame = self.latest()
+        if frame and frame.seq != last_seq:
+            return frame
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.wait_for(loop.sock_recv(self._notify_socket, 64), timeout)
+        except asyncio.TimeoutError:
+            return None
+        except OSError:
+            pass
+        self._drain_notifications()
+        frame = self.latest()
+        return frame if frame and frame.seq != last_seq else None
+
+    def close(self):
+        self._detach()
+        self._notify_socket.close()
@@ -0,0 +1,55 @@
+import numpy as np
+#smoothing and short term prediction for joint angles
+#
+#one euro filter (casiez et al. 2012) on every channel at once: a low pass whose cutoff goes
+#up with speed, so a still hand doesn't chatter and a moving hand doesn't lag. the filtered
+#output's own speed (smoothed again) pushes each angle forward by the pipeline latency so the
+#arm ends up where the hand is now instead of where it was when the frame was captured.
+#predicting from the filtered output rather than the raw speed keeps noise from being amplified
+
+def smoothing_factor(cutoff, dt):
+    tau = 1 / (2 * np.pi * cutoff)
+    return 1 / (1 + tau / dt)
+
+class OneEuroPredictor:
+    def __init__(self, min_cutoff=1.0, beta=0.05, d_cutoff=1.0, max_horizon=0.25, limits=(0, 180)):
+        self.min_cutoff = min_cutoff #hz, smoothing when still, lower is smoother
+        self.beta = beta #how fast the cutoff rises with speed, higher is less lag
+        self.d_cutoff = d_cutoff #hz, smoothing of the speed estimate
+        self.max_horizon = max_horizon #seconds, never predict further ahead than this
+        self.limits = limits
+        self.reset()
+
+    def reset(self):
+        self.value = None
+        self.speed = None #raw speed estimate, drives the cutoff
+        self.trend = None #speed of the filtered output, drives the prediction
+        self.timestamp = None
+
+    def update(self, values, timestamp, horizon=0.0):
+        #values: array of angles (any shape), timestamp in seconds, horizon: how far ahead to predict
+        values = np.asarray(values, dtype=np.float64)
+        if self.value is None or self.value.shape != values.shape:
+            self.value = values.copy()
+            self.speed = np.zeros_like(values)
+            self.trend = np.zeros_like(values)
+            self.timestamp = timestamp
+            return np.clip(values, *self.limits)
+
+        dt = timestamp - self.timestamp
+        if dt <= 0: #same or older frame, nothing new to learn from it
+            return self.predict(horizon)
+        self.timestamp = timestamp
+
+        speed_factor = smoothing_factor(self.d_cutoff, dt)
+        raw_speed = (values - self.value) / dt
+        self.speed += speed_factor * (raw_speed - self.speed)
+        cutoff = self.min_cutoff + self.beta * np.abs(self.speed)
+        step = smoothing_factor(cutoff, dt) * (values - self.value)
+        self.value += step
+        self.trend += speed_factor * (step / dt - self.trend)
+        return self.predict(horizon)
+
+    def predict(self, horizon=0.0):
+        horizon = min(max(horizon, 0.0), self.max_horizon)
+        return np.clip(self.value + self.trend * horizon, *self.limits)
@@ -0,0 +1,153 @@
+#angle packets between the computer and the esp32
+#
+#binary frame (version 1):
+#   byte 0    : 0x80 | version << 4 | flags   (high bit is set so it can never be an ascii digit)
+#   byte 1    : sequence number, wraps at 256
+#   byte 2-3  : channel mask (little endian), bit n set means channel n is in the frame
+#   byte 4-5  : trace id (little endian), only if FLAG_TRACE is set
+#   then      : one byte per set channel (angle 0-180), lowest channel first
+#   last byte : checksum if FLAG_CHECKSUM is set, sum of every byte before it & 0xFF
+#
+#frames only have to carry the channels that changed (delta updates). FLAG_KEYFRAME marks a
+#frame with every channel in it, sent now and then so the esp32 catches up after a lost packet
+#
+#when FLAG_TRACE is set the esp32 answers on its tx characteristic with an ack:
+#   b'K', trace id (2 bytes), microseconds from receiving the frame to setting the servos (2 bytes)
+#
+#frame size is 4 header bytes + 1 per channel, + 2 when traced, + 1 with the checksum. the
+#default 23 byte ble mtu leaves a 20 byte payload: the 12 channels the client sends fit with the
+#checksum and the trace id (19 bytes), a full 16 channel update only fits without both (20 bytes,
+#21 with the checksum the client turns on by default, 23 traced). the firmware decoders in
+#esp32_code mirror this file, keep them in sync if the layout changes
+#
+#ascii frames ('180,180,90,...\n') are still supported as a fallback. each one ends in a newline,
+#the esp32 appends writes that land before it reads them and without it two frames would run
+#together ('...,90180,180,...')
+
+PROTOCOL_VERSION = 1
+MAX_CHANNELS = 16
+HEADER_SIZE = 4
+BINARY_MARKER = 0x80
+
+FLAG_CHECKSUM = 0x01
+FLAG_TRACE = 0x02
+FLAG_KEYFRAME = 0x04
+
+TRACE_SIZE = 2
+ACK_MARKER = b'K'
+ACK_SIZE = 5
+
+class ProtocolError(ValueError):
+    pass
+
+def checksum(data):
+    return sum(data) & 0xFF
+
+def clamp_angle(angle):
+    return max(0, min(180, int(angle)))
+
+def is_binary(data):
+    return bool(data) and bool(data[0] & BINARY_MARKER)
+
+#-----------------------------------------------------------------------------------#
+#                                    Encoding
+#
+#-----------------------------------------------------------------------------------#
+def encode_frame(angles, seq, channels=None, with_checksum=True, trace_id=None, keyframe=False):
+    #angles: list of angles, sent on channels 0..n-1 unless channels lists which channel each one is for
+    #trace_id: optional 16 bit id the esp32 acks back so the latency can be measured
+    #keyframe: the frame holds every channel, only a marker for the receiver
+    if channels is None:
+        channels = range(len(angles))
+    by_channel = dict(zip(channels, angles))
+    if len(by_channel) != len(angles) or any(not 0 <= channel < MAX_CHANNELS for channel in by_channel):
+        raise ProtocolError(f'channels must be unique and between 0 and {MAX_CHANNELS - 1}')
+
+    mask = 0
+    for channel in by_channel:
+        mask |= 1 << channel
+    flags = ((FLAG_CHECKSUM if with_checksum else 0) | (FLAG_TRACE if trace_id is not None else 0)
+             | (FLAG_KEYFRAME if keyframe else 0))
+    frame = bytearray((BINARY_MARKER | PROTOCOL_VERSION << 4 | flags, seq & 0xFF, mask & 0xFF, mask >> 8))
+    if trace_id is not None:
+        frame.extend(((trace_id & 0xFF), (trace_id >> 8) & 0xFF))
+    frame.extend(clamp_angle(by_channel[channel]) for channel in sorted(by_channel))
+    if with_checksum:
+        frame.append(checksum(frame))
+    return bytes(frame)
+
+def encode_ascii(angles):
+    return (','.join(map(str, angles)) + '\n').encode()
+
+#-----------------------------------------------------------------------------------#
+#                                    Decoding
+#
+#-----------------------------------------------------------------------------------#
+def max_frame_size(channel_count=MAX_CHANNELS):
+    #longest binary frame with this many channels (traced, with checksum)
+    return HEADER_SIZE + TRACE_SIZE + channel_count + 1
+
+def frame_length(data, offset=0):
+    #total length of the binary frame starting at offset, taken from its header
+    if len(data) - offset < HEADER_SIZE:
+        raise ProtocolError('frame is shorter than its header')
+    header = data[offset]
+    mask = data[offset + 2] | data[offset + 3] << 8
+    return (HEADER_SIZE + (TRACE_SIZE if header & FLAG_TRACE else 0) + bin(mask).count('1')
+            + (1 if header & FLAG_CHECKSUM else 0))
+
+def decode_frame(data, offset=0):
+    #returns (seq, channels, angles, length) for the binary frame starting at offset
+    #use decode_trace_id for the trace id and is_keyframe for the keyframe flag
+    if len(data) - offset < HEADER_SIZE or not data[offset] & BINARY_MARKER:
+        raise ProtocolError('not a binary angle frame')
+    header = data[offset]
+    version = (header >> 4) & 0x07
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f'unsupported protocol version {version}')
+
+    length = frame_length(data, offset)
+    if len(data) - offset < length:
+        raise ProtocolError('frame is truncated')
+    if header & FLAG_CHECKSUM and checksum(data[offset:offset + length - 1]) != data[offset + length - 1]:
+        raise ProtocolError('bad checksum')
+
+    seq = data[offset + 1]
+    mask = data[offset + 2] | data[offset + 3] << 8
+    channels = [channel for channel in range(MAX_CHANNELS) if mask >> channel & 1]
+    angle_offset = offset + HEADER_SIZE + (TRACE_SIZE if header & FLAG_TRACE else 0)
+    angles = list(data[angle_offset:angle_offset + len(channels)])
+    return seq, channels, angles, length
+
+def is_keyframe(data, offset=0):
+    return bool(data[offset] & FLAG_KEYFRAME)
+
+def decode_trace_id(data, offset=0):
+    #trace id of the frame starting at offset, None if it wasn't traced
+    if not data[offset] & FLAG_TRACE:
+        return None
+    return data[offset + HEADER_SIZE] | data[offset + HEADER_SIZE + 1] << 8
+
+def encode_ack(trace_id, actuation_us):
+    actuation_us = max(0, min(0xFFFF, int(actuation_us)))
+    return ACK_MARKER + bytes((trace_id & 0xFF, (trace_id >> 8) & 0xFF, actuation_us & 0xFF, actuation_us >> 8))
+
+def decode_ack(data):
+    #returns (trace id, actuation microseconds), or None if data isn't an ack
+    if len(data) != ACK_SIZE or data[:1] != ACK_MARKER:
+        return None
+    return data[1] | data[2] << 8, data[3] | data[4] << 8
+
+def decode_ascii(data):
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode()
+    data = data.strip()
+    if not data:
+        return []
+    return [int(angle.strip()) for angle in data.split(',')]
+
+def decode_ascii_frames(data):
+    #every frame in a read that may hold several newline terminated ones
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode()
+    return [decode_ascii(line) for line in data.split('\n') if line.strip()]
@@ -0,0 +1,105 @@
+import asyncio
+#ble writes for the angle frames
+#
+#every write with response waits a full connection interval round trip for the esp32's ack
+#before the next one can start, so by default frames go out as write without response.
+#frames are packed back to back into one write up to what fits in the negotiated mtu (the
+#firmware decoders walk every frame in a write), and at most max_in_flight writes are
+#outstanding at once. while they are, new frames wait in the next write until it is full,
+#after that can_send is False and the caller holds on to its newest angles instead of
+#queueing more. a write longer than one packet (an ascii frame at the default 23 byte mtu)
+#goes with response, bleak splits those into prepare writes, without response it would fail
+
+ATT_HEADER = 3 #bytes of each att packet that aren't payload
+MIN_PAYLOAD = 20 #payload of the default 23 byte mtu
+
+class BleTransport:
+    def __init__(self, client, char_uuid, response=False, max_in_flight=2, batch=True):
+        #batch: pack several frames in one write, only for the binary protocol (ascii has no framing)
+        self.client = client
+        self.char_uuid = char_uuid
+        self.response = response
+        self.max_in_flight = max_in_flight
+        self.batch = batch
+        self.payload_size = MIN_PAYLOAD
+        self._characteristic = char_uuid
+        self._pending = bytearray()
+        self._writes = set()
+        self._error = None
+        self.failures = 0 #writes in a row that failed, only a write that goes through resets it
+        self.frames = 0
+        self.writes = 0
+        self.bytes = 0
+
+    def start(self):
+        #looks up the characteristic and how many bytes one write can carry on this connection
+        characteristic = self.client.services.get_characteristic(self.char_uuid)
+        if characteristic is not None:
+            self._characteristic = characteristic
+            if not self.response and 'write-without-response' not in characteristic.properties:
+                print('Server does not take writes without response, waiting for a response on every write')
+                self.response = True
+            if not self.response:
+                self.payload_size = max(MIN_PAYLOAD, characteristic.max_write_without_response_size)
+        if self.response:
+            #longer writes with response are split into prepare/execute writes, which is slower
+            self.payload_size = max(MIN_PAYLOAD, self.client.mtu_size - ATT_HEADER)
+            self.max_in_flight = 1
+        print(f"Writing {'with' if self.response else 'without'} response, {self.payload_size} bytes per write, "
+              f"{self.max_in_flight} write(s) in flight")
+
+    @property
+    def in_flight(self):
+        return len(self._writes)
+
+    def can_send(self, frame_size):
+        #False when the writes in flight are at the limit and the next write is full
+        if len(self._writes) < self.max_in_flight:
+            return True #nothing is waiting, the frame goes straight out
+        return self.batch and len(self._pending) + frame_size <= self.payload_size
+
+    def send(self, frame):
+        #returns False (and drops the frame) if can_send would have said no
+        if not self.can_send(len(frame)):
+            return False
+        self._pending += frame
+        self.frames += 1
+        self._flush()
+        return True
+
+    def check(self):
+        #raises the error of a write that failed since the last check
+        if self._error:
+            error, self._error = self._error, None
+            raise error
+
+    def _flush(self):
+        if not self._pending or len(self._writes) >= self.max_in_flight:
+            return
+        data = bytes(self._pending)
+        self._pending.clear()
+        response = self.response or len(data) > self.payload_size
+        write = asyncio.create_task(self.client.write_gatt_char(self._characteristic, data, response=response))
+        write.add_done_callback(self._write_done)
+        self._writes.add(write)
+        self.writes += 1
+        self.bytes += len(data)
+
+    def _write_done(self, write):
+        self._writes.discard(write)
+        if write.cancelled():
+            return
+        if write.exception():
+            self._error = write.exception()
+            self.failures += 1
+            return
+        self.failures = 0
+        self._flush() #whatever piled up while the link was busy
+
+    async def close(self, timeout=0.5):
+        #gives the last writes a moment to finish, then cancels them
+        self._pending.clear()
+        if self._writes:
+            await asyncio.wait(list(self._writes), timeout=timeout)
+        for write in list(self._writes):
+            write.cancel()
@@ -1,6 +1,11 @@
-import asyncio, subprocess, time
+import asyncio, json, os, signal, sys, time
 from bleak import BleakClient, BleakScanner
 import keyboard
+from angle_channel import AngleChannelReader, CHANNEL_NAME, NOTIFY_PORT, arm_channel
+import angle_protocol
+from latency_trace import LatencyTracker
+from ble_transport import BleTransport
+from supervisor import report_ready
 
 # Constants
 SERVER_NAME = "ESP-32 S3"
@@ -9,30 +14,43 @@ UART_WRITE_CHAR_UUID = "6E400002-B5A3-F393-E0A9-E50E24DCCA9E" #server's rx
 UART_READ_CHAR_UUID = "6E400003-B5A3-F393-E0A9-E50E24DCCA9E" #server's tx
 #client write and read characteristic is the servers 'rx and tx' characteristics mirrored
 
-FILE_PATH = r"C:\Users\adria\Downloads\bionic_arm_proj\data\angle_list.txt"
+#'binary' sends compact frames (see angle_protocol.py), 'ascii' sends the old '180,180,90,...' text
+PROTOCOL = 'binary'
+USE_CHECKSUM = True
 
-def start_computer_vision():
-    script_path = r"C:\Users\adria\Downloads\bionic_arm_proj\src\Hand_tracking.py" 
-    try:
-        process = subprocess.Popen(["python", script_path], 
-                                   stdout=subprocess.PIPE, 
-                                   stderr=subprocess.PIPE)
-        print("Computer Vision script started.")
-        return process
-    except Exception as e:
-        print(f"Failed to start Computer Vision script: {e}")
-        return None
-    
-async def wait_for_cv_startup(seconds):
-    print(f"Waiting for Computer Vision to start up...")
-    for i in range(seconds):
-        print(f"Waiting... {i+1}/{seconds}")
-        await asyncio.sleep(1)
-    print("Wait complete. Proceeding with data transmission.")
+#sending
+SEND_RATE_HZ = 30 #max packets per second, the newest frame is sent on each tick
+STATS_INTERVAL = 5 #seconds between send rate reports
+VERBOSE = False #print every packet
+TRACE_LATENCY = False #tag binary frames with trace ids and report per hop latency from the esp32 acks
+
+#writing (see ble_transport.py): without response there is no round trip per packet. binary
+#frames sent while MAX_WRITES_IN_FLIGHT writes are outstanding are packed into the next write
+WRITE_WITH_RESPONSE = False
+MAX_WRITES_IN_FLIGHT = 2
 
-def read_file():
-    with open(FILE_PATH, 'r') as file:
-        return file.read().strip()
+#delta updates (binary only): send just the channels that moved at least their dead-band since
+#they were last sent, plus a full keyframe every KEYFRAME_INTERVAL seconds so the esp32 catches
+#up if a packet was lost. ascii always sends the whole list when any channel moved
+DELTA_UPDATES = True
+DEAD_BAND = 3 #degrees, one number for every channel or a list with one per channel
+KEYFRAME_INTERVAL = 1.0 #seconds
+
+#several arms from one tracking host (see hand_routes in hand_tracking.py): one entry per esp32
+#with the arm it plays and optionally its own send rate. every device runs its own send loop,
+#rate and write window in the same event loop, so one slow link doesn't hold the others up.
+#None is the single SERVER_NAME device on arm 0
+DEVICES = None #e.g. [{'name': 'ESP-32 S3', 'arm': 0}, {'name': 'ESP-32 S3 left', 'arm': 1, 'send_rate': 20}]
+
+#connecting: the address each device was last seen at is kept in ADDRESS_CACHE and the next
+#connect goes straight to it, a scan by name is only the fallback. a link that drops is brought
+#back with backoff while hand tracking keeps running, and sending starts again from the newest frame
+ADDRESS_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'ble_devices.json') #None to turn off
+CONNECT_TIMEOUT = 5.0 #seconds to wait on the known address before scanning
+SCAN_TIMEOUT = 10.0
+RECONNECT = True
+RECONNECT_BACKOFF = [0, 0.5, 1, 2, 5] #seconds before each attempt after a failed one, the last repeats
+MAX_SEND_ERRORS = 5 #failed ticks in a row on a link that still looks connected before we reconnect
 
 # def parse_data(data):
 #     if not data:
@@ -54,113 +72,413 @@ def parse_data(data):
             parsed_data.append(180 if not x else int(x))
     return parsed_data
 
-async def run_client():
-    print("Scanning for device...")
+def encode_angles(angles, seq, trace_id=None, channels=None, keyframe=False):
+    if PROTOCOL == 'ascii':
+        return angle_protocol.encode_ascii(angles)
+    return angle_protocol.encode_frame(angles, seq, channels=channels, with_checksum=USE_CHECKSUM,
+                                       trace_id=trace_id, keyframe=keyframe)
 
-    #await isn't necessary here, but find_device_by_name is an async function
-    #so.... (could help if we have other functionalities that can be performed while looking 
-    #for device)
-    device = await BleakScanner.find_device_by_name(SERVER_NAME)
-    
+class DeltaEncoder:
+    #picks what goes in the next packet: the channels that moved at least their dead-band since
+    #they were last sent, or all of them in a keyframe
+    def __init__(self, dead_band=DEAD_BAND, keyframe_interval=KEYFRAME_INTERVAL, delta=True):
+        self.dead_band = dead_band
+        self.keyframe_interval = keyframe_interval
+        self.delta = delta
+        self.sent = None #last value sent on each channel
+        self.last_keyframe = 0
 
-    if not device:
-        print(f"Could not find device with name '{SERVER_NAME}'")
+    def band(self, channel):
+        if isinstance(self.dead_band, (list, tuple)):
+            return self.dead_band[channel] if channel < len(self.dead_band) else self.dead_band[-1]
+        return self.dead_band
+
+    def update(self, angles, now):
+        #returns (channels, angles, keyframe) to send, or None when nothing moved enough
+        if self.sent is None or len(self.sent) != len(angles) or now - self.last_keyframe >= self.keyframe_interval:
+            self.sent = list(angles)
+            self.last_keyframe = now
+            return list(range(len(angles))), list(angles), True
+
+        changed = [channel for channel, angle in enumerate(angles)
+                   if abs(angle - self.sent[channel]) >= self.band(channel)]
+        if not changed:
+            return None
+        if not self.delta: #whole list, like before delta updates
+            changed = list(range(len(angles)))
+        for channel in changed:
+            self.sent[channel] = angles[channel]
+        return changed, [angles[channel] for channel in changed], False
+
+def load_address_cache():
+    try:
+        with open(ADDRESS_CACHE) as file:
+            return json.load(file)
+    except (OSError, ValueError): #no cache yet, or a broken one we'll write over
+        return {}
+
+def remember_address(device_name, address):
+    if not ADDRESS_CACHE:
         return
+    cache = load_address_cache()
+    cache[device_name] = address
+    try:
+        with open(ADDRESS_CACHE, 'w') as file:
+            json.dump(cache, file, indent=2)
+    except OSError as e:
+        print(f"Could not save the device address: {e}")
 
-    print(f"Found device: {device.name}")
-    
-    #set event
-    disconnected_event = asyncio.Event()
+class ConnectionMetrics:
+    #how long connecting takes and how often the link had to be brought back
+    def __init__(self):
+        self.connects = 0
+        self.reconnects = 0
+        self.failed_attempts = 0
+        self.connect_times = [] #seconds from starting a connect until connected
+        self.gaps = [] #seconds from losing the link until connected again
+        self._lost_at = None
 
+    def connected(self, seconds, now):
+        self.connects += 1
+        self.connect_times.append(seconds)
+        if self._lost_at is not None:
+            self.reconnects += 1
+            self.gaps.append(now - self._lost_at)
+            self._lost_at = None
 
-    def disconnected_callback(client):
-        print("device was disconnected, goodbye xx.")
-        disconnected_event.set()
+    def lost(self, now):
+        self._lost_at = now
 
-    #acctually connected to the esp32
-    async with BleakClient(device, disconnected_callback=disconnected_callback) as client:
-        print(f"Connected to {device.name}")
+    def summary(self):
+        text = f"{self.connects} connects, {self.reconnects} reconnects, {self.failed_attempts} failed attempts"
+        if self.connect_times:
+            text += (f", connect time avg {sum(self.connect_times) / len(self.connect_times):.2f} s "
+                     f"max {max(self.connect_times):.2f} s")
+        if self.gaps:
+            text += f", reconnect gap avg {sum(self.gaps) / len(self.gaps):.2f} s max {max(self.gaps):.2f} s"
+        return text
 
-        #start computer vision before reading data, this is a synchronous operation
-        #we do not want to start anything until this opens to read the data
-        # cv_process = start_computer_vision()
-        # if cv_process is None:
-        #     print('CV was none... could not open, check exception')
-        #     return
-        
-        #it takes a while for the computer vision to load right now
-        # await wait_for_cv_startup(15)
+class SendStats:
+    #achieved send rate and dropped frames, printed every STATS_INTERVAL seconds
+    def __init__(self, interval=STATS_INTERVAL, tracker=None, name=None, target_rate=None):
+        self.interval = interval
+        self.tracker = tracker
+        self.prefix = f"[{name}] " if name else ""
+        self.target_rate = target_rate or SEND_RATE_HZ
+        self.total_sent = 0
+        self.total_dropped = 0
+        self.reset(time.monotonic())
 
-        last_sent_data = None
-        stop_flag = asyncio.Event()
+    def reset(self, now):
+        self.window_start = now
+        self.sent = 0
+        self.keyframes = 0
+        self.bytes = 0
+        self.unchanged = 0
+        self.dropped = 0 #frames from hand tracking that were replaced by a newer one before they were sent
+        self.busy = 0 #ticks skipped because the last write was still going
 
-        #stop program by pressing 'g'
-        def on_press(key):
-            if key.name == 'g':
-                print("Stop key pressed. Ending program...")
-                stop_flag.set()
+    def report(self, now, force=False):
+        elapsed = now - self.window_start
+        if elapsed < self.interval and not (force and elapsed > 0):
+            return
+        self.total_sent += self.sent
+        self.total_dropped += self.dropped
+        print(f"{self.prefix}Send rate: {self.sent / elapsed:.1f} Hz (target {self.target_rate} Hz, {self.keyframes} keyframes), "
+              f"{self.bytes / elapsed:.0f} B/s, {self.dropped} frames dropped, {self.unchanged} unchanged, "
+              f"{self.busy} ticks with link busy")
+        if self.tracker:
+            self.tracker.report()
+        self.reset(now)
 
-        #set event (seperate thread listening)
+def listen_for_stop_key(stop_flag):
+    #stop program by pressing 'g', the keyboard hook calls us from its own thread
+    loop = asyncio.get_running_loop()
+    def on_press(key):
+        if key.name == 'g':
+            print("Stop key pressed. Ending program...")
+            loop.call_soon_threadsafe(stop_flag.set)
+
+    #on linux this needs root so it can be missing
+    try:
         keyboard.on_press(on_press)
+    except Exception as e:
+        print(f"Stop key not available ({e!r}), use ctrl+c to stop")
+
+async def sleep_unless_stopped(stop_flag, seconds):
+    try:
+        await asyncio.wait_for(stop_flag.wait(), seconds)
+    except asyncio.TimeoutError:
+        pass
+
+async def wait_unless_disconnected(waiter, disconnected):
+    #waiter's result, or None as soon as the link goes so a lost link isn't noticed only after
+    #the angle wait times out (up to data_timeout with no hand in view)
+    wait_task = asyncio.ensure_future(waiter)
+    disconnect_task = asyncio.ensure_future(disconnected.wait())
+    try:
+        await asyncio.wait({wait_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        disconnect_task.cancel()
+    if wait_task.done():
+        return wait_task.result()
+    wait_task.cancel()
+    return None
+
+async def connect_device(scanner, client_class, device_name, address, disconnected_callback, prefix=""):
+    #straight to the address the device was last seen at, a name scan only if that doesn't answer
+    #returns (connected client, how we found it) or (None, None)
+    if address:
+        client = client_class(address, disconnected_callback=disconnected_callback, timeout=CONNECT_TIMEOUT)
+        try:
+            await client.connect()
+            return client, 'known address'
+        except Exception as e:
+            print(f"{prefix}No answer at {address} ({e!r}), scanning instead")
+
+    print(f"{prefix}Scanning for device...")
+    device = await scanner.find_device_by_name(device_name, timeout=SCAN_TIMEOUT)
+    if not device:
+        print(f"{prefix}Could not find device with name '{device_name}'")
+        return None, None
+
+    print(f"{prefix}Found device: {device.name}")
+    client = client_class(device, disconnected_callback=disconnected_callback)
+    try:
+        await client.connect()
+    except Exception as e:
+        print(f"{prefix}Could not connect to {device.name}: {e!r}")
+        return None, None
+    return client, 'scan'
+
+async def run_client(scanner=BleakScanner, client_class=BleakClient, channel_name=CHANNEL_NAME, notify_port=NOTIFY_PORT,
+                     device_name=None, send_rate=None, stop_flag=None, metrics=None):
+    #scanner / client_class: bleak's by default, fake_peripheral.py has stand ins to run without the esp32
+    #stop_flag: shared by every device when run_devices drives several, otherwise the 'g' key gets its own
+    #metrics: a ConnectionMetrics to fill in, if the caller wants to look at it afterwards
+    #returns True when we stopped on purpose ('g' or the esp32 shutting down), False when the
+    #device wasn't found or the connection went away and RECONNECT is off
+    device_name = device_name or SERVER_NAME
+    send_rate = send_rate or SEND_RATE_HZ
+    prefix = f"[{device_name}] " if stop_flag is not None else ""
+    if stop_flag is None:
+        stop_flag = asyncio.Event()
+        listen_for_stop_key(stop_flag)
+    server_stopped = asyncio.Event() #only stops this device
+    metrics = metrics or ConnectionMetrics()
+
+    tracker = LatencyTracker() if TRACE_LATENCY else None
 
-        #async because its a special case where its used as a callback function
-        async def notification_handler(sender, data):
-            if data == b'cunt':
-                print("Server is shutting down.")
-                stop_flag.set()
+    #async because its a special case where its used as a callback function
+    async def notification_handler(sender, data):
+        ack = angle_protocol.decode_ack(data)
+        if ack:
+            if tracker:
+                tracker.ack_received(*ack)
+        elif data == b'cunt':
+            print(f"{prefix}Server is shutting down.")
+            server_stopped.set()
 
+    last_valid_data = None
+    last_valid_time = 0
+    data_timeout = 0.7  
+
+    def control_data(current_data):
+        #hold the last valid angles for a bit when tracking drops out, then go to default
+        nonlocal last_valid_data, last_valid_time
+        if any(current_data): #if all current data is truthy
+            last_valid_data = current_data
+            last_valid_time = time.time()
+            return current_data
+        elif last_valid_data and (time.time() - last_valid_time) < data_timeout:
+            return last_valid_data
+        # return [180] * 8
+        return [180, 180, 90] * 4 #default position
+
+    #angles come from hand tracking through shared memory, we sleep until a new frame is published.
+    #hand tracking runs on its own (python supervisor.py starts both and waits for each to be
+    #ready) and keeps going while we reconnect, until it publishes angles we hold the default position
+    angle_channel = AngleChannelReader(channel_name, notify_port)
+    stats = SendStats(tracker=tracker, name=device_name if prefix else None, target_rate=send_rate)
+    packet_seq = 0
+    writes = 0
+
+    async def stream(client, disconnected):
+        #sends until we are stopped or the link goes. starts from the newest frame with a keyframe,
+        #whatever was published while we were disconnected is already old
+        nonlocal packet_seq, writes
         await client.start_notify(UART_READ_CHAR_UUID, notification_handler)
 
-        last_valid_data = None
-        last_valid_time = 0
-        data_timeout = 0.7  
+        #send at most send_rate, always the newest frame, and never more than the transport
+        #lets through so nothing queues up behind a slow link
+        transport = BleTransport(client, UART_WRITE_CHAR_UUID, response=WRITE_WITH_RESPONSE,
+                                 max_in_flight=MAX_WRITES_IN_FLIGHT, batch=PROTOCOL == 'binary')
+        transport.start()
+        loop = asyncio.get_running_loop()
+        period = 1 / send_rate
+        next_tick = loop.time()
+        last_frame_seq = None
+        pending_data = None
+        pending_frame = None #frame pending_data came from, None for held/default angles
+        delta_encoder = DeltaEncoder(delta=DELTA_UPDATES and PROTOCOL == 'binary')
+        errors = 0 #ticks in a row that failed before a write, failed writes are transport.failures
 
-        while not stop_flag.is_set() and client.is_connected:
-            try:
-                #do not need to be async because we need these things to happen before sending
-                file_content = read_file()
-                current_data = parse_data(file_content)
-
-                #control data
-                if any(current_data): #if all current data is truthy
-                    last_valid_data = current_data
-                    last_valid_time = time.time()
-                elif last_valid_data and (time.time() - last_valid_time) < data_timeout:
-                    current_data = last_valid_data
-                else:
-                    # current_data = [180] * 8
-                    current_data = [180, 180, 90] * 4 #default position
-
-                #check if at least one of the angles differs by 2 to indicate
-                #a change in data then send that
-                if last_sent_data is None or any(abs(a - b) >= 3 for a, b in zip(current_data, last_sent_data)):
-                    
-                    data_to_send = ','.join(map(str, current_data)).encode()
-                    await client.write_gatt_char(UART_WRITE_CHAR_UUID, data_to_send)
-
-                    print(f"Sent: {data_to_send}")
-                    last_sent_data = current_data
-                else:
-                    print("angle is not significantly different, not sending.")
-
-                await asyncio.sleep(0.3) #read every few .3second
+        def take_frame(frame):
+            nonlocal last_frame_seq, pending_frame
+            pending_frame = frame
+            if last_frame_seq is not None and frame.seq > last_frame_seq + 1:
+                stats.dropped += frame.seq - last_frame_seq - 1
+            last_frame_seq = frame.seq
+            return control_data(list(frame.values))
 
-            except Exception as e:
-                print(f"An error occurred: {e}")
-                break
+        try:
+            while not stop_flag.is_set() and not server_stopped.is_set() and not disconnected.is_set() and client.is_connected:
+                try:
+                    frame = await wait_unless_disconnected(
+                        angle_channel.wait_for_frame(last_frame_seq, timeout=period if pending_data else data_timeout), disconnected)
+                    if disconnected.is_set():
+                        break
+                    if frame:
+                        pending_data = take_frame(frame)
+                    elif pending_data is None:
+                        pending_data = control_data([]) #nothing new, hold or fall back to default
+                        pending_frame = None
+
+                    #wait for the tick, then grab whatever is newest by then
+                    delay = next_tick - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                        frame = angle_channel.latest()
+                        if frame and frame.seq != last_frame_seq:
+                            pending_data = take_frame(frame)
+                    next_tick = max(next_tick + period, loop.time())
+                    stats.report(time.monotonic())
 
-        if not client.is_connected:
-            print("Connection was lost.")
+                    transport.check() #raises if a write failed
+                    errors = 0
+                    if not transport.can_send(angle_protocol.max_frame_size(len(pending_data))):
+                        stats.busy += 1 #keep pending_data, the newest frame goes on the next free tick
+                        continue
 
-        print("Disconnecting...")
-        await client.stop_notify(UART_READ_CHAR_UUID)
+                    #only the channels that moved past their dead-band (or a keyframe) get sent
+                    current_data = pending_data
+                    pending_data = None
+                    update = delta_encoder.update(current_data, time.monotonic())
+                    if update:
+                        channels, angles, keyframe = update
+                        trace_id = pending_frame.seq & 0xFFFF if tracker and pending_frame else None
+                        data_to_send = encode_angles(angles, packet_seq, trace_id, channels, keyframe)
+                        if trace_id is not None:
+                            tracker.frame_sent(trace_id, pending_frame)
+                        transport.send(data_to_send)
+                        packet_seq = (packet_seq + 1) & 0xFF
+                        stats.sent += 1
+                        stats.keyframes += keyframe
+                        stats.bytes += len(data_to_send)
 
-        # if cv_process:
-        #     cv_process.terminate()
-        #     print('Computer Vision closed!')
+                        if VERBOSE:
+                            print(f"Sent: {data_to_send}")
+                    else:
+                        stats.unchanged += 1
+                        if VERBOSE:
+                            print("angle is not significantly different, not sending.")
 
-    await disconnected_event.wait()
-    print('Disconnected!')
+                except Exception as e:
+                    #a failed write on a link that is still up is usually a one off, keep going
+                    print(f"{prefix}An error occurred: {e}")
+                    errors += 1
+                    #check() only raises once per failed write, so the ticks in between don't count
+                    #as the link working again, transport.failures only resets when a write goes through
+                    if not client.is_connected or errors >= MAX_SEND_ERRORS or transport.failures >= MAX_SEND_ERRORS:
+                        break
+        finally:
+            await transport.close()
+            writes += transport.writes
+
+    address = load_address_cache().get(device_name) if ADDRESS_CACHE else None
+    failed_attempts = 0 #in a row, for the backoff
+    try:
+        while not stop_flag.is_set() and not server_stopped.is_set():
+            disconnected_event = asyncio.Event()
+
+            def disconnected_callback(client):
+                print(f"{prefix}device was disconnected, goodbye xx.")
+                disconnected_event.set()
+
+            started = time.perf_counter()
+            client, found_by = await connect_device(scanner, client_class, device_name, address,
+                                                    disconnected_callback, prefix)
+            if client is None:
+                metrics.failed_attempts += 1
+                if not RECONNECT:
+                    return False
+                delay = RECONNECT_BACKOFF[min(failed_attempts, len(RECONNECT_BACKOFF) - 1)]
+                failed_attempts += 1
+                await sleep_unless_stopped(stop_flag, delay)
+                continue
+
+            #acctually connected to the esp32
+            failed_attempts = 0
+            now = time.perf_counter()
+            metrics.connected(now - started, now)
+            print(f"{prefix}Connected to {device_name} in {now - started:.2f} s ({found_by})")
+            if client.address != address:
+                address = client.address
+                remember_address(device_name, address)
+            report_ready('connected')
+
+            try:
+                await stream(client, disconnected_event)
+            except Exception as e:
+                print(f"{prefix}An error occurred: {e}")
+            finally:
+                if client.is_connected:
+                    print(f"{prefix}Disconnecting...")
+                    try:
+                        await client.stop_notify(UART_READ_CHAR_UUID)
+                        await client.disconnect()
+                    except Exception as e:
+                        print(f"{prefix}An error occurred while disconnecting: {e}")
+                print(f'{prefix}Disconnected!')
+
+            if not stop_flag.is_set() and not server_stopped.is_set():
+                metrics.lost(time.perf_counter())
+                print(f"{prefix}Connection was lost.{' Reconnecting...' if RECONNECT else ''}")
+                if not RECONNECT:
+                    return False
+    finally:
+        angle_channel.close()
+        stats.report(time.monotonic(), force=True)
+        print(f"{prefix}Sent {stats.total_sent} packets in {writes} writes, {stats.total_dropped} frames dropped")
+        print(f"{prefix}Connection: {metrics.summary()}")
+    return True
+
+async def run_devices(devices=DEVICES, scanner=BleakScanner, client_class=BleakClient,
+                      channel_name=CHANNEL_NAME, notify_port=NOTIFY_PORT):
+    #one run_client per device in DEVICES, all at once in this event loop, each reading its own
+    #arm's angle channel. returns True when every device stopped on purpose
+    stop_flag = asyncio.Event()
+    listen_for_stop_key(stop_flag)
+    clients = [run_client(scanner, client_class, *arm_channel(device.get('arm', 0), channel_name, notify_port),
+                          device_name=device['name'], send_rate=device.get('send_rate'),
+                          stop_flag=stop_flag)
+               for device in devices]
+    results = await asyncio.gather(*clients, return_exceptions=True) #one device failing leaves the others going
+    for device, result in zip(devices, results):
+        if isinstance(result, Exception):
+            print(f"[{device['name']}] An error occurred: {result!r}")
+    return all(result is True for result in results)
+
+def install_stop_handlers():
+    #the supervisor stops us with ctrl+break on windows, which kills the process by default before
+    #we disconnect, make it a ctrl+c so run_client's cleanup runs (the same as hand_tracking does)
+    if hasattr(signal, 'SIGBREAK'):
+        signal.signal(signal.SIGBREAK, signal.default_int_handler)
 
 if __name__ == "__main__":
-    asyncio.run(run_client())
+    install_stop_handlers()
+    try:
+        stopped = asyncio.run(run_devices() if DEVICES else run_client())
+    except KeyboardInterrupt: #ctrl+c, or the supervisor stopping us
+        stopped = True
+    sys.exit(0 if stopped else 1)
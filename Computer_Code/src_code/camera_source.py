@@ -0,0 +1,222 @@
+import time
+from collections import deque
+import numpy as np
+import cv2
+#camera frame sources for hand tracking
+#
+#cv2.VideoCapture on its own runs with whatever the driver picks and keeps a few frames in its
+#buffer, so when inference falls behind read() hands back frames that are already old.
+#CameraSource asks for the resolution, fps, pixel format and buffer size we want, reports what
+#the driver actually gave us and can grab-and-discard: a grab that comes back straight away was
+#sitting in the buffer, so it is thrown away and we grab again until one has to wait for the
+#camera. the tracker always gets the newest frame that way. that is only done when the driver
+#didn't take a one frame buffer, with one the waiting frame is never more than a period old and
+#throwing it away just means waiting for the next
+#
+#VideoFileSource plays a video file through the same read() / isOpened() / release() calls, in
+#real time by default (frames it falls behind on are skipped like a live camera would), so
+#tracking can be tested without a camera. open_source picks one from an index or a path
+
+#formats the camera sends, MJPG gets higher resolutions and fps over usb 2, YUYV skips the jpeg decode
+FOURCCS = ('MJPG', 'YUYV')
+MAX_STALE_GRABS = 8 #never discard more than this many buffered frames in one read
+STALE_FRACTION = 0.25 #a grab quicker than this fraction of a frame period came out of the buffer
+DEFAULT_FPS = 30 #frame period to go by when the driver won't say
+
+def fourcc_to_text(value):
+    value = int(value)
+    if value <= 0:
+        return None
+    return ''.join(chr((value >> (8 * i)) & 0xFF) for i in range(4))
+
+class CaptureStats:
+    #time between delivered frames, the spread of it is the capture jitter
+    def __init__(self, max_samples=1000):
+        self.intervals = deque(maxlen=max_samples)
+        self.frames = 0
+        self.failed = 0
+        self.stale = 0 #frames grabbed and thrown away
+        self._last = None
+
+    def frame(self, now):
+        if self._last is not None:
+            self.intervals.append(now - self._last)
+        self._last = now
+        self.frames += 1
+
+    def summary(self):
+        if not self.intervals:
+            return f'{self.frames} frames, {self.failed} failed reads'
+        intervals = np.array(self.intervals) * 1000
+        return (f'{self.frames} frames at {1000 / intervals.mean():.1f} fps, interval ms p50 / p95 / max: '
+                f'{np.percentile(intervals, 50):.1f} / {np.percentile(intervals, 95):.1f} / {intervals.max():.1f}, '
+                f'jitter (std) {intervals.std():.1f} ms, {self.stale} stale frames dropped, {self.failed} failed reads')
+
+class CameraSource:
+    def __init__(self, index, name='camera', width=None, height=None, fps=None, fourcc=None,
+                 buffer_size=None, drop_stale=False, backend=None):
+        #settings left as None keep the driver's default, backend is a cv2.CAP_* api preference
+        self.name = name
+        self.requested = {'width': width, 'height': height, 'fps': fps, 'fourcc': fourcc, 'buffer_size': buffer_size}
+        self.drop_stale = drop_stale
+        self.cap = cv2.VideoCapture(index) if backend is None else cv2.VideoCapture(index, backend)
+        self.stats = CaptureStats()
+        if self.cap.isOpened():
+            self.configure()
+        self.settings = self.negotiated_settings()
+        if self.settings['buffer_size'] == 1: #nothing older than a frame period is ever waiting
+            self.drop_stale = False
+        self._stale_grab_time = STALE_FRACTION / (self.settings['fps'] or DEFAULT_FPS)
+
+    def configure(self):
+        #the format goes first, a lot of drivers only offer some sizes and rates in some formats
+        if self.requested['fourcc']:
+            self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*self.requested['fourcc']))
+        if self.requested['width']:
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.requested['width'])
+        if self.requested['height']:
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.requested['height'])
+        if self.requested['fps']:
+            self.cap.set(cv2.CAP_PROP_FPS, self.requested['fps'])
+        if self.requested['buffer_size']:
+            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, self.requested['buffer_size']) #not every backend supports it
+
+    def negotiated_settings(self):
+        #what the driver says it's running at, 0 / None where it won't tell
+        return {
+            'width': int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            'height': int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            'fps': self.cap.get(cv2.CAP_PROP_FPS),
+            'fourcc': fourcc_to_text(self.cap.get(cv2.CAP_PROP_FOURCC)),
+            'buffer_size': int(self.cap.get(cv2.CAP_PROP_BUFFERSIZE)),
+            'backend': self.cap.getBackendName() if self.cap.isOpened() else None,
+        }
+
+    def describe(self):
+        settings = self.settings
+        text = (f"{self.name}: {settings['width']}x{settings['height']} {settings['fourcc'] or '?'} "
+                f"@ {settings['fps']:.1f} fps, buffer {settings['buffer_size'] or '?'} ({settings['backend']})")
+        differs = [f'{key} {value}' for key, value in self.requested.items()
+                   if value and str(settings[key]).lower() != str(value).lower()]
+        if differs:
+            text += f", asked for {', '.join(differs)}"
+        return text
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def grab_newest(self):
+        #grab until a grab has to wait on the camera, the ones before it were old frames
+        for grabs in range(MAX_STALE_GRABS + 1):
+            start = time.perf_counter()
+            if not self.cap.grab():
+                return False
+            if time.perf_counter() - start >= self._stale_grab_time or grabs == MAX_STALE_GRABS:
+                return True
+            self.stats.stale += 1
+
+    def grab(self):
+        #grab and retrieve are split so several cameras can be grabbed at the same moment and
+        #decoded after
+        ret = self.grab_newest() if self.drop_stale else self.cap.grab()
+        if not ret:
+            self.stats.failed += 1
+        return ret
+
+    def retrieve(self):
+        ret, frame = self.cap.retrieve()
+        if ret:
+            self.stats.frame(time.perf_counter())
+        else:
+            self.stats.failed += 1
+        return ret, frame
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def report(self):
+        print(f'{self.name}: {self.stats.summary()}')
+
+    def release(self):
+        self.cap.release()
+
+class VideoFileSource:
+    def __init__(self, path, name='video', realtime=True, loop=False):
+        #realtime: hand out frames at the file's frame rate and skip the ones we are too slow for
+        self.name = name
+        self.path = path
+        self.realtime = realtime
+        self.loop = loop
+        self.cap = cv2.VideoCapture(path)
+        self.stats = CaptureStats()
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS
+        self.settings = {'width': int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                         'height': int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), 'fps': self.fps,
+                         'fourcc': fourcc_to_text(self.cap.get(cv2.CAP_PROP_FOURCC)), 'buffer_size': 0,
+                         'backend': 'file'}
+        self._start = None
+        self._position = 0 #index of the next frame in the file
+        self._ended = False
+
+    def describe(self):
+        settings = self.settings
+        return (f"{self.name}: {settings['width']}x{settings['height']} @ {self.fps:.1f} fps from {self.path}"
+                f"{' (real time)' if self.realtime else ''}")
+
+    def isOpened(self):
+        return self.cap.isOpened() and not self._ended
+
+    def _grab(self):
+        if self.cap.grab():
+            self._position += 1
+            return True
+        if self.loop and self._position:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            self._start = time.perf_counter()
+            self._position = 0
+            return self._grab()
+        self._ended = True
+        return False
+
+    def grab(self):
+        if self._start is None:
+            self._start = time.perf_counter()
+        if self.realtime:
+            #sleep until the next frame is due, or skip the ones that are already past
+            due = self._start + self._position / self.fps
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            behind = int((time.perf_counter() - self._start) * self.fps) - self._position
+            for _ in range(max(0, behind)):
+                if not self._grab():
+                    break
+                self.stats.stale += 1
+        return self._grab()
+
+    def retrieve(self):
+        ret, frame = self.cap.retrieve()
+        if ret:
+            self.stats.frame(time.perf_counter())
+        else:
+            self.stats.failed += 1
+        return ret, frame
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def report(self):
+        print(f'{self.name}: {self.stats.summary()}')
+
+    def release(self):
+        self.cap.release()
+
+def open_source(source, name='camera', **settings):
+    #source: camera index, or the path of a video file to play instead
+    if isinstance(source, str) and not source.isdigit():
+        return VideoFileSource(source, name)
+    return CameraSource(int(source), name, **settings)
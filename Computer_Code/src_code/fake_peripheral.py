@@ -0,0 +1,230 @@
+import asyncio, random, time
+import angle_protocol
+from bluetooth_client import SERVER_NAME, UART_WRITE_CHAR_UUID, UART_READ_CHAR_UUID
+#stand in for the esp32 so bluetooth_client can run without the board
+#
+#FakeScanner and FakeClient have the parts of bleak's BleakScanner and BleakClient that
+#run_client uses, pass them in with run_client(scanner=FakeScanner(peripheral), client_class=FakeClient).
+#the FakePeripheral behind them acts like the nordic uart service on the firmware: every write
+#to rx is walked frame by frame the way the firmware decoders do, traced frames are acked on
+#tx, ascii falls back to '180,180,90,...' and shutdown() notifies b'cunt' like the board does
+#on a keyboard interrupt
+#
+#link conditions:
+#   latency : one way delay in seconds
+#   jitter  : up to this much extra random delay per packet (the link still keeps the order)
+#   mtu     : att mtu, a write without response longer than mtu - 3 fails
+#   loss    : chance a write without response never arrives (writes with response are retried
+#             by the link layer, so they always arrive, just later)
+#
+#a FakeClient can also be made from a peripheral's address like a BleakClient, disconnect()
+#drops the link from the esp32's side and powered = False makes it stop answering altogether
+
+ATT_HEADER = 3
+
+class FakePeripheral:
+    by_address = {} #every peripheral made, so a FakeClient can connect by address
+
+    def __init__(self, latency=0.0075, jitter=0.0, mtu=247, loss=0.0, actuation=0.0005,
+                 name=SERVER_NAME, seed=None):
+        self.name = name
+        self.address = f'FA:KE:00:00:00:{len(FakePeripheral.by_address) + 1:02X}'
+        FakePeripheral.by_address[self.address] = self
+        self.powered = True
+        self.latency = latency
+        self.jitter = jitter
+        self.mtu = mtu
+        self.loss = loss
+        self.actuation = actuation #seconds the esp32 reports for setting the servos
+        self.angles = [None] * angle_protocol.MAX_CHANNELS #last angle applied on each channel
+        self.on_frame = None #optional callback(seq, channels, angles, trace id, time applied)
+        self.writes = 0
+        self.frames = 0
+        self.bytes = 0
+        self.lost = 0
+        self.bad = 0
+        self._client = None
+        self._notify = None
+        self._rng = random.Random(seed)
+        self._last_rx = 0.0
+        self._last_tx = 0.0
+
+    @property
+    def payload_size(self):
+        return self.mtu - ATT_HEADER
+
+    def link_delay(self):
+        return self.latency + self._rng.uniform(0, self.jitter)
+
+    def lose_packet(self):
+        if self.loss and self._rng.random() < self.loss:
+            self.lost += 1
+            return True
+        return False
+
+    #-------------------------------- client -> esp32 --------------------------------#
+    def send_to_peripheral(self, data, delay):
+        #the write arrives after delay, never before an earlier one
+        loop = asyncio.get_running_loop()
+        self._last_rx = max(loop.time() + delay, self._last_rx)
+        loop.call_at(self._last_rx, self.receive, bytes(data))
+
+    def receive(self, data):
+        if not self._client:
+            return
+        self.writes += 1
+        self.bytes += len(data)
+        now = time.time()
+        if not angle_protocol.is_binary(data):
+            try:
+                frames = angle_protocol.decode_ascii_frames(data)
+            except ValueError:
+                self.bad += 1
+                return
+            for angles in frames:
+                self.apply(None, list(range(len(angles))), angles, None, now)
+            return
+
+        #a single write can hold more than one frame, stop at the first bad one like the firmware
+        offset = 0
+        while offset < len(data):
+            try:
+                seq, channels, angles, length = angle_protocol.decode_frame(data, offset)
+            except angle_protocol.ProtocolError:
+                self.bad += 1
+                return
+            trace_id = angle_protocol.decode_trace_id(data, offset)
+            self.apply(seq, channels, angles, trace_id, now)
+            if trace_id is not None:
+                self.notify(angle_protocol.encode_ack(trace_id, self.actuation * 1000000))
+            offset += length
+
+    def apply(self, seq, channels, angles, trace_id, now):
+        for channel, angle in zip(channels, angles):
+            if channel < len(self.angles):
+                self.angles[channel] = angle
+        self.frames += 1
+        if self.on_frame:
+            self.on_frame(seq, channels, angles, trace_id, now)
+
+    #-------------------------------- esp32 -> client --------------------------------#
+    def notify(self, data):
+        if not self._notify:
+            return
+        loop = asyncio.get_running_loop()
+        self._last_tx = max(loop.time() + self.link_delay(), self._last_tx)
+        loop.call_at(self._last_tx, self._deliver_notification, bytes(data))
+
+    def _deliver_notification(self, data):
+        if self._notify and self._client:
+            result = self._notify(None, bytearray(data))
+            if asyncio.iscoroutine(result): #bleak runs async handlers as tasks
+                asyncio.ensure_future(result)
+
+    def shutdown(self):
+        #what the board sends on a keyboard interrupt, the client stops and disconnects
+        self.notify(b'cunt')
+
+    def disconnect(self):
+        #the link dropping from the esp32's side
+        if self._client:
+            self._client._lost_connection()
+
+class FakeCharacteristic:
+    def __init__(self, uuid, properties, max_write_without_response_size):
+        self.uuid = uuid
+        self.properties = properties
+        self.max_write_without_response_size = max_write_without_response_size
+
+class FakeServices:
+    def __init__(self, characteristics):
+        self._characteristics = {characteristic.uuid.lower(): characteristic for characteristic in characteristics}
+
+    def get_characteristic(self, uuid):
+        return self._characteristics.get(str(uuid).lower())
+
+class FakeScanner:
+    #finds the peripherals it was made with, by name, after scan_time seconds of scanning
+    def __init__(self, *peripherals, scan_time=0.0):
+        self.peripherals = peripherals
+        self.scan_time = scan_time
+        self.scans = 0
+
+    async def find_device_by_name(self, name, timeout=10.0):
+        self.scans += 1
+        for peripheral in self.peripherals:
+            if peripheral.name == name and peripheral.powered:
+                await asyncio.sleep(min(self.scan_time, timeout))
+                return peripheral
+        await asyncio.sleep(timeout)
+        return None
+
+class FakeClient:
+    def __init__(self, device, disconnected_callback=None, timeout=10.0):
+        #device: a FakePeripheral, or the address of one
+        if isinstance(device, str):
+            self.address = device
+            device = FakePeripheral.by_address.get(device.upper())
+        else:
+            self.address = device.address
+        self.peripheral = device
+        self.timeout = timeout
+        self._disconnected_callback = disconnected_callback
+        self.is_connected = False
+        if device is not None:
+            self.mtu_size = device.mtu
+            self.services = FakeServices([
+                FakeCharacteristic(UART_WRITE_CHAR_UUID, ['write', 'write-without-response'], device.payload_size),
+                FakeCharacteristic(UART_READ_CHAR_UUID, ['notify'], device.payload_size),
+            ])
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.disconnect()
+
+    async def connect(self):
+        if self.peripheral is None or not self.peripheral.powered:
+            await asyncio.sleep(self.timeout) #nothing answers, like bleak we give up after the timeout
+            raise TimeoutError(f'device {self.address} not found')
+        await asyncio.sleep(2 * self.peripheral.latency)
+        self.peripheral._client = self
+        self.is_connected = True
+        return True
+
+    async def disconnect(self):
+        if self.is_connected:
+            self._lost_connection()
+        return True
+
+    def _lost_connection(self):
+        self.is_connected = False
+        self.peripheral._client = None
+        self.peripheral._notify = None
+        if self._disconnected_callback:
+            self._disconnected_callback(self)
+
+    async def start_notify(self, char_specifier, callback):
+        self.peripheral._notify = callback
+
+    async def stop_notify(self, char_specifier):
+        self.peripheral._notify = None
+
+    async def write_gatt_char(self, char_specifier, data, response=None):
+        if not self.is_connected:
+            raise ConnectionError('not connected')
+        peripheral = self.peripheral
+        if response:
+            #longer writes are split into prepare writes, each one waits for its response
+            chunks = max(1, -(-len(data) // peripheral.payload_size))
+            delay = peripheral.link_delay()
+            peripheral.send_to_peripheral(data, delay + 2 * delay * (chunks - 1))
+            await asyncio.sleep(2 * delay * chunks)
+            return
+        if len(data) > peripheral.payload_size:
+            raise ValueError(f'write without response of {len(data)} bytes, the mtu allows {peripheral.payload_size}')
+        if not peripheral.lose_packet():
+            peripheral.send_to_peripheral(data, peripheral.link_delay())
+        await asyncio.sleep(0)
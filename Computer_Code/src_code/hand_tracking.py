@@ -1,24 +1,110 @@
-import mediapipe as mp
+import threading, time, queue, os, signal, sys
+startup_start = time.perf_counter() #for the startup profile
 import numpy as np
 import cv2
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from angle_channel import AngleChannelWriter, arm_channel
+from landmark_recording import LandmarkRecorder
+from camera_source import open_source
+from angle_filter import OneEuroPredictor
+from supervisor import report_ready
 #hand tracking code
 #updates------
 #lateral angle calculation assuming forward orientation
 
-#cameras
-front_cam = cv2.VideoCapture(0)
-back_cam = None #cv2.VideoCapture(1)
+#cameras, set an index to None to turn that camera off or to a video file's path to play it instead
+#the cameras and hands are opened in open_cameras() so worker processes don't grab them on import
+front_cam_index = 0
+back_cam_index = None #1
+front_cam = None
+back_cam = None
+#what we ask the cameras for (see camera_source.py), None keeps the driver's default. the
+#settings they actually run at are printed when they open
+camera_width = None #640
+camera_height = None #480
+camera_fps = None #30
+camera_fourcc = None #'MJPG' or 'YUYV'
+camera_buffer_size = 1 #frames the driver may hold, fewer means less stale ones
+#grab and throw away buffered frames so inference gets the newest one. only worth it when the driver
+#ignores camera_buffer_size, with a one frame buffer the frame thrown away is at most a frame old and
+#waiting for the next one rounds every loop up to a frame boundary (camera_source skips it then anyway)
+drop_stale_frames = False
+
+#several hands driving several arms: mediapipe looks for up to max_num_hands and hand_routes
+#says which arm each one drives, by handedness ('Left' / 'Right') or by the order mediapipe
+#found them in (0, 1, ...). every arm has its own angle channel (angle_channel.arm_channel) and
+#its own entry in the bluetooth client's DEVICES. None drives arm 0 with the first hand found.
+#mediapipe expects a mirrored image, so check which label each hand gets on your camera.
+#mediapipe always looks for at least one hand per route (see hands_to_find)
+max_num_hands = 1
+hand_routes = None #e.g. {'Right': 0, 'Left': 1}
+
+#run grab, inference and output on separate threads (see pipelined_capture_loop)
+pipeline_mode = False
+#run each camera's capture and inference in its own process (see process_capture_loop)
+process_per_camera = False
+camera_result_max_age = 0.25 #seconds, older results from a camera are left out of the fusion
+#front and back frames captured further apart than this aren't fused, the newer one is used (see fuse_angles)
+fusion_tolerance = 0.05 #seconds
+
+#region of interest: only give mediapipe the area around the last hand (see RoiTracker)
+roi_mode = False
+roi_margin = 0.35 #extra space around the hand, as a fraction of the hand's size on each side
+#downscale what mediapipe gets so its longest side is at most this many pixels, None to turn off
+input_max_side = None
+
+#skip inference while nothing moves (see MotionGate)
+motion_gating = False
+motion_threshold = 1.5 #mean grey level change (0-255) in the hand area that counts as movement
+motion_max_skip = 15 #always run inference after this many skipped frames in a row
+#or after this long, nothing is published while frames are skipped and the bluetooth client takes
+#0.7 s without a new frame (data_timeout) for a lost hand, this keeps slow cameras well under that
+#and under camera_result_max_age
+motion_max_skip_time = 0.2 #seconds
+
+#smooth the angles and predict them forward by the pipeline latency before writing (see angle_filter.py)
+angle_filtering = False
+filter_min_cutoff = 1.0 #hz, lower is smoother when the hand is still
+filter_beta = 0.05 #higher is less lag when the hand moves fast
+#seconds of latency after the angles are written (ipc + ble + servo), the tracking side is
+#measured per frame. take this from the bluetooth client's latency trace
+prediction_extra_latency = 0.05
+angle_predictors = {} #arm -> OneEuroPredictor
+
+#display
+#headless skips every drawing and window call, stop with ctrl+c or SIGTERM instead of 'q'
+headless = False
+preview_rate_hz = 0 #headless only, above 0 shows the cameras at this rate from a thread of its own
+preview = None
+stop_event = threading.Event() #set to stop whichever capture loop is running
 
 #files
-#change directory to where the angle and dictionary text files are
-transmission_file = r"C:\Users\adria\Downloads\bionic_arm_proj\data\angle_list.txt"
-validation_file = r"C:\Users\adria\Downloads\bionic_arm_proj\data\dictionary.txt"
+#dictionary text file in the repo's data folder, change it if you keep it somewhere else
+validation_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'dictionary.txt')
+
+#angles for bluetooth go through shared memory (see angle_channel.py), opened on first write
+angle_channel = None
+arm_channels = {} #arm -> writer for the arms after 0
+first_frame_written = threading.Event() #for the supervisor's readiness check (see supervisor.py) and the startup profile
+
+#set to a file path to record the raw landmarks of every frame (see landmark_recording.py)
+record_path = None
+landmark_recorder = None
 
 #hand initialisation
-mp_draw = mp.solutions.drawing_utils
-mp_hands = mp.solutions.hands
-front_hand = mp_hands.Hands(min_detection_confidence=0.9, min_tracking_confidence=0.9)
-back_hand = mp_hands.Hands(min_detection_confidence=0.9, min_tracking_confidence=0.9)
+#mediapipe is imported on first use (see load_mediapipe), the import alone takes about a second
+#and the replay and benchmarks only need the angle maths. the models load on a thread while the
+#cameras open, then run once on a blank frame so the first real frame isn't the slow one
+mp = None
+mp_draw = None
+mp_hands = None
+mediapipe_lock = threading.Lock()
+warm_up_model = True
+startup_profile = True #print how long each startup step took once the first frame is through
+startup_steps = [] #(step, start, end), seconds from startup_start
+front_hand = None
+back_hand = None
 
 finger_dictionary = {
     'Thumb' : [4, 3, 2, 1],
@@ -28,35 +114,103 @@ finger_dictionary = {
     'Pinky' : [20, 19, 18, 17],
 }
 
+#array versions of the dictionary for the batched angle engine
+finger_names = list(finger_dictionary.keys())
+finger_indices = np.array(list(finger_dictionary.values())) #(5, 4) -> tip, a, b, c for each finger
+WRIST = 0
+NUM_LANDMARKS = 21
+ANGLE_KEYS = ['A', 'B', 'C', 'lat']
+
 #-----------------------------------------------------------------------------------#
 #                                   Write File
 #
 #-----------------------------------------------------------------------------------#
-def clear_files():
+def get_angle_channel(arm=0):
+    global angle_channel
+    if arm != 0:
+        if arm not in arm_channels:
+            name, notify_port = arm_channel(arm)
+            arm_channels[arm] = AngleChannelWriter(name=name, notify_port=notify_port)
+        return arm_channels[arm]
+    if angle_channel is None:
+        angle_channel = AngleChannelWriter()
+    return angle_channel
+
+def close_angle_channel():
+    global angle_channel
+    if angle_channel is not None:
+        angle_channel.close()
+        angle_channel = None
+    for channel in arm_channels.values():
+        channel.close()
+    arm_channels.clear()
+
+def routed_arms():
+    return sorted(set(hand_routes.values())) if hand_routes else [0]
+
+def clear_files(arms=None):
+    #arms: the arms that lost their hand, all of them by default
     try:
-        open(transmission_file, 'w').close()
-        open(validation_file, 'w').close()
+        arms = routed_arms() if arms is None else arms
+        if 0 in arms:
+            open(validation_file, 'w').close()
+        for arm in arms:
+            get_angle_channel(arm).publish([]) #empty frame tells bluetooth there is no hand
     except Exception as e:
         print(f'An error occured in clearing files: {e}')
 
-def write_angles(angles):
+def filter_angles(angles, timing=None, arm=0):
+    #one euro smoothing on every angle at once, pushed forward by the measured latency
+    if arm not in angle_predictors:
+        angle_predictors[arm] = OneEuroPredictor(filter_min_cutoff, filter_beta)
+    angle_predictor = angle_predictors[arm]
+    if not angles:
+        angle_predictor.reset() #don't carry a lost hand's speed into the next one
+        return angles
+
+    now = time.time()
+    capture_start, capture_time = (timing[0], timing[1]) if timing else (now, now)
+    horizon = (now - capture_start) + prediction_extra_latency
+    values = np.array([[angle['A'], angle['B'], angle['C'], angle['lat']] for angle in angles.values()])
+    filtered = angle_predictor.update(values, capture_time, horizon)
+    return {finger: {'A': int(round(a)), 'B': int(round(b)), 'C': int(round(c)), 'lat': int(round(lat))}
+            for finger, (a, b, c, lat) in zip(angles.keys(), filtered.tolist())}
+
+def write_angles(angles, timing=None):
+    #timing: optional (capture start, capture end, inference done) for latency tracing
+    #with hand_routes set angles is arm -> angles and every arm gets its own channel
+    if not first_frame_written.is_set(): #a frame made it through the model, with or without a hand
+        first_frame_written.set()
+        report_ready('frame')
+    if not hand_routes:
+        write_arm_angles(angles, timing)
+        return
+    for arm in routed_arms():
+        write_arm_angles(angles.get(arm, {}), timing, arm)
+
+def write_arm_angles(angles, timing=None, arm=0):
     try:
+        if angle_filtering:
+            angles = filter_angles(angles, timing, arm)
+
         if not angles:
-            clear_files()
+            clear_files([arm])
             return
         
-        #validate angles written to transmission are the same here
-        with open(validation_file, 'w') as file:
-            for finger, angle in angles.items():
-                file.write(f"{finger}: A={angle['A']}, B={angle['B']}, C={angle['C']}, lat={angle['lat']}\n")
+        #validate angles written to transmission are the same here (arm 0's)
+        if arm == 0:
+            with open(validation_file, 'w') as file:
+                for finger, angle in angles.items():
+                    file.write(f"{finger}: A={angle['A']}, B={angle['B']}, C={angle['C']}, lat={angle['lat']}\n")
 
         #we are omitting the thumb for now and also angle A, need to experiment which angles to use
         angle_list = [value for finger, angle_dictionary in angles.items() if finger != 'Thumb'
                     for value in (angle_dictionary['A'], angle_dictionary['B'], angle_dictionary['lat'])]
         
-        #write angles to file for bluetooth to read
-        with open(transmission_file, 'w') as file:
-            file.write(','.join(map(str, angle_list)))
+        #publish angles for bluetooth to read
+        capture_start, capture_time, inference_time = timing if timing else (0.0, 0.0, 0.0)
+        get_angle_channel(arm).publish(angle_list, capture_start=capture_start, capture_time=capture_time,
+                                       inference_time=inference_time)
     except Exception as e:
         print(f'An error occured in writing angles: {e}')
         return
@@ -93,13 +247,19 @@ def mirror_x(landmark):
         print(f'An error occured in mirroring: {e}')
         return None
 
-def rotate_coordinates(landmark, angle_degrees=260):
+def rotation_matrix_x(angle_degrees=260):
     angle_radians = np.radians(angle_degrees)
-    rotation_matrix = np.array([
+    return np.array([
         [1, 0, 0],
         [0, np.cos(angle_radians), -np.sin(angle_radians)],
         [0, np.sin(angle_radians), np.cos(angle_radians)]
     ])
+
+#built once, the lateral angle always uses the same rotation
+lateral_rotation_matrix = rotation_matrix_x(260)
+
+def rotate_coordinates(landmark, angle_degrees=260):
+    rotation_matrix = lateral_rotation_matrix if angle_degrees == 260 else rotation_matrix_x(angle_degrees)
     coordinates = np.array([landmark.x, landmark.y, landmark.z])
     rotated_coordinates = np.dot(rotation_matrix, coordinates)
     return type(landmark)(x=rotated_coordinates[0], y=rotated_coordinates[1], z=rotated_coordinates[2])  
@@ -159,131 +319,916 @@ def calculate_angle(p1, p2, p3):
         print(f'An error occured in calculate angle: {e}')
         return 180
 
+#-----------------------------------------------------------------------------------#
+#                              Batched angle engine
+#   works on a (21, 3) landmark array or a (N, 21, 3) batch of them, every finger
+#   and joint is calculated at once instead of one calculate_angle call per joint
+#-----------------------------------------------------------------------------------#
+def landmarks_to_array(detected_landmarks):
+    if isinstance(detected_landmarks, np.ndarray):
+        return detected_landmarks.astype(np.float64, copy=False)
+    return np.array([(lm.x, lm.y, lm.z) for lm in detected_landmarks], dtype=np.float64)
+
+def valid_landmark_mask(points):
+    #same checks as is_landmark_detected, but for every landmark in the array
+    x, y, z = points[..., 0], points[..., 1], points[..., 2]
+    return (0 <= x) & (x <= 1) & (0 <= y) & (y <= 1) & (z != 0)
+
+def joint_angles(p1, p2, p3):
+    #angle at p2 between p1 and p3, same as calculate_angle (180 if a vector has no length)
+    v1 = p1 - p2
+    v2 = p3 - p2
+    magnitude_1 = np.linalg.norm(v1, axis=-1)
+    magnitude_2 = np.linalg.norm(v2, axis=-1)
+    degenerate = (magnitude_1 == 0) | (magnitude_2 == 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cosine_angle = np.einsum('...i,...i->...', v1, v2) / (magnitude_1 * magnitude_2)
+    degree = np.degrees(np.arccos(np.clip(cosine_angle, -1.0, 1.0)))
+    return np.where(degenerate, 180.0, np.clip(degree, 0, 180))
+
+def lateral_angles(rotated_pip, rotated_base, is_right):
+    #same as calculate_lateral_angle, points have to be rotated already
+    dx = rotated_pip[..., 0] - rotated_base[..., 0]
+    dz = rotated_pip[..., 2] - rotated_base[..., 2]
+    magnitude = np.sqrt(dx * dx + dz * dz)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dot_product = dx / magnitude #dot of the unit finger vector with i is just its x
+    angle = np.degrees(np.arccos(np.clip(dot_product, -1.0, 1.0)))
+    capped_angle = np.clip(angle, 60, 120) #make min lateral bend 60 and max 120
+    capped_angle = np.where(is_right, 180 - capped_angle, capped_angle) #same angle no matter what hand is detected
+    return np.where(magnitude == 0, 90.0, capped_angle)
+
+def finger_angle_array(points, hand_types, is_back_camera=False):
+    #points: (N, 21, 3), hand_types: one label or one per hand
+    #returns (N, 5, 4) ints, fingers in finger_names order and A, B, C, lat per finger
+    points = np.asarray(points, dtype=np.float64)
+    is_right = (np.asarray(hand_types) == "Right").reshape(-1, 1)
+
+    finger_points = points
+    if is_back_camera:
+        finger_points = points.copy()
+        finger_points[..., 0] = 1 - finger_points[..., 0]
+
+    finger_valid = valid_landmark_mask(points)[:, finger_indices].all(axis=-1) #(N, 5)
+    joints = finger_points[:, finger_indices] #(N, 5, 4, 3)
+    tip, a, b, c = joints[:, :, 0], joints[:, :, 1], joints[:, :, 2], joints[:, :, 3]
+    wrist = np.broadcast_to(points[:, WRIST, None, :], c.shape) #wrist is never mirrored
+
+    rotated = joints[:, :, 2:] @ lateral_rotation_matrix.T
+    angles = np.stack([
+        joint_angles(tip, a, b),
+        joint_angles(a, b, c),
+        joint_angles(b, c, wrist),
+        lateral_angles(rotated[:, :, 0], rotated[:, :, 1], is_right),
+    ], axis=-1)
+
+    #fingers with a missing landmark get the default position
+    angles = np.where(finger_valid[..., None], angles, [180, 180, 180, 90])
+    return np.trunc(angles).astype(int)
+
+def angle_array_to_dict(hand_angles):
+    return {finger: {'A': int(a), 'B': int(b), 'C': int(c), 'lat': int(lat)}
+            for finger, (a, b, c, lat) in zip(finger_names, hand_angles.tolist())}
+
+def calculate_finger_angles_batch(points, hand_types, is_back_camera=False):
+    #(21, 3) gives one angle dictionary, (N, 21, 3) gives a list of them
+    try:
+        points = np.asarray(points, dtype=np.float64)
+        if points.ndim == 2:
+            return angle_array_to_dict(finger_angle_array(points[None], hand_types, is_back_camera)[0])
+        return [angle_array_to_dict(hand_angles) for hand_angles in finger_angle_array(points, hand_types, is_back_camera)]
+    except Exception as e:
+        print(f'An error occured in calculating batched finger angles: {e}')
+        return {} if np.ndim(points) == 2 else []
+
 def calculate_finger_angles(detected_landmarks, hand_type, is_back_camera=False):
     try:
-        finger_angles = {}
-        for finger, finger_landmarks in finger_dictionary.items():
-            landmark = []
-            for lm in finger_landmarks:
-                if is_landmark_detected(detected_landmarks[lm]):
-                    valid_lm = detected_landmarks[lm]
-                    mirrored_lm = mirror_x(valid_lm) if is_back_camera else valid_lm
-                    landmark.append(mirrored_lm)
-                else:
-                    landmark.append(None) #if its invalid, then populate it as none 
-
-            if all(landmark): #we do not need to check if len(landmark) == 4 because every iteration of loop will be 4 elements
-                tip, a, b, c = landmark 
-                angle_a = calculate_angle(tip, a, b)
-                angle_b = calculate_angle(a, b, c)
-                angle_c = calculate_angle(b, c, detected_landmarks[0]) #[0] is wrist
-                lateral_angle = calculate_lateral_angle(b, c, hand_type)
-                finger_angles[finger] = {'A': int(angle_a), 'B' : int(angle_b), 'C' : int(angle_c), 'lat': int(lateral_angle)}
-            else:
-                finger_angles[finger] = {'A': 180, 'B': 180, 'C': 180, 'lat': 90}
-        return finger_angles
+        points = landmarks_to_array(detected_landmarks)
+        return angle_array_to_dict(finger_angle_array(points[None], hand_type, is_back_camera)[0])
     
     except Exception as e:
         print(f'An error occured in calculating finer angles: {e}')
         return {}
 
-def average_angles(front, back):
+def finger_weights(detected_landmarks, score=1.0):
+    #how much to trust each finger's angles from one camera (finger_names order): mediapipe's
+    #handedness score times their mean visibility when the model fills that in. a finger with any
+    #landmark off the image gets the placeholder angles from finger_angle_array, so it gets no
+    #weight at all (same mask as finger_angle_array)
+    weights = valid_landmark_mask(landmarks_to_array(detected_landmarks))[finger_indices].all(axis=-1).astype(np.float64)
+    if not isinstance(detected_landmarks, np.ndarray):
+        visibility = np.array([getattr(landmark, 'visibility', 0.0) for landmark in detected_landmarks])
+        if visibility.any():
+            weights = weights * visibility[finger_indices].mean(axis=-1)
+    return score * weights
+
+def add_finger_weights(angles, detected_landmarks, score=1.0):
+    #puts each finger's weight in its angle dictionary for fuse_angles
+    for finger, weight in zip(finger_names, finger_weights(detected_landmarks, score).tolist()):
+        if finger in angles:
+            angles[finger]['weight'] = weight
+    return angles
+
+def strip_weights(angles):
+    #same shape as fused angles, the weights are only for fuse_angles
+    return {finger: {key: angle[key] for key in ANGLE_KEYS} for finger, angle in angles.items()}
+
+def fuse_angles(front, back, front_time=None, back_time=None):
+    #front and back camera angles in one, each finger's angles weighted by how much each camera
+    #can be trusted on it ('weight', 1 when missing). plain python, for 5 fingers x 4 angles
+    #building numpy arrays costs more than the math.
+    #frames captured more than fusion_tolerance apart show the hand at different moments, so
+    #only the newer one is used, same as when just one camera sees the hand
     try:
-        finger_order = [finger for finger, _ in finger_dictionary.items()]
-        averaged_angles = {}
-        for finger in finger_order:
-            if finger in front and finger in back:
-                averaged_angles[finger] = {
-                    'A': (front[finger]['A'] + back[finger]['A']) // 2,
-                    'B': (front[finger]['B'] + back[finger]['B']) // 2,
-                    'C': (front[finger]['C'] + back[finger]['C']) // 2,
-                    'lat': (front[finger]['lat'] + back[finger]['lat'] // 2)
-                }
-            #elif the finger is only captured in either front or back,
-            #just use that orientation's angles
-            elif finger in front:
-                averaged_angles[finger] = front[finger]
-            elif finger in back:
-                averaged_angles[finger] = back[finger]
-        return averaged_angles
-    
+        if not front or not back:
+            return strip_weights(front or back)
+        if front_time is not None and back_time is not None and abs(front_time - back_time) > fusion_tolerance:
+            return strip_weights(front if front_time >= back_time else back)
+
+        fused = {}
+        for finger in finger_names:
+            front_angle = front.get(finger)
+            back_angle = back.get(finger)
+            if not front_angle or not back_angle:
+                if front_angle or back_angle:
+                    only_angle = front_angle or back_angle
+                    fused[finger] = {key: only_angle[key] for key in ANGLE_KEYS}
+                continue
+            #a little weight for everything seen so two untrusted cameras still average
+            front_weight = front_angle.get('weight', 1.0) + 1e-6
+            front_share = front_weight / (front_weight + back_angle.get('weight', 1.0) + 1e-6)
+            back_share = 1 - front_share
+            fused[finger] = {
+                'A': round(front_angle['A'] * front_share + back_angle['A'] * back_share),
+                'B': round(front_angle['B'] * front_share + back_angle['B'] * back_share),
+                'C': round(front_angle['C'] * front_share + back_angle['C'] * back_share),
+                'lat': round(front_angle['lat'] * front_share + back_angle['lat'] * back_share),
+            }
+        return fused
+
     except Exception as e:
-        print(f'An error occured in average_angles: {e}')
+        print(f'An error occured in fuse_angles: {e}')
         return {}
 
+#-----------------------------------------------------------------------------------#
+#                              Region of interest tracking
+#   crops the frame around the hand found in the last frame so mediapipe works on a small
+#   image, landmarks are mapped back to full frame coordinates so the angle math is unaffected
+#-----------------------------------------------------------------------------------#
+class RoiTracker:
+    def __init__(self, margin=0.35, min_size=0.2):
+        self.margin = margin
+        self.min_size = min_size #smallest crop, as a fraction of the frame
+        self.box = None #(x0, y0, x1, y1) in normalised full frame coordinates, None = full frame
+        self.crops = 0
+        self.full_frames = 0
+
+    def crop(self, frame):
+        #returns the part of the frame to process and its pixel box (None if it's the whole frame)
+        if self.box is None:
+            self.full_frames += 1
+            return frame, None
+        height, width = frame.shape[:2]
+        x0, y0, x1, y1 = self.box
+        pixel_box = (int(x0 * width), int(y0 * height), int(np.ceil(x1 * width)), int(np.ceil(y1 * height)))
+        self.crops += 1
+        return frame[pixel_box[1]:pixel_box[3], pixel_box[0]:pixel_box[2]], pixel_box
+
+    def update(self, hand_obj_list, pixel_box, frame_shape):
+        #map landmarks from the crop back to the full frame (in place) and move the box if needed
+        if not hand_obj_list:
+            self.box = None #lost the hand, next frame uses the whole image
+            return
+        height, width = frame_shape[:2]
+        if pixel_box is not None:
+            left, top, right, bottom = pixel_box
+            crop_width = right - left
+            crop_height = bottom - top
+            for detected_hand in hand_obj_list:
+                for landmark in detected_hand.landmark:
+                    landmark.x = (left + landmark.x * crop_width) / width
+                    landmark.y = (top + landmark.y * crop_height) / height
+                    landmark.z = landmark.z * crop_width / width #z is on the same scale as x
+
+        xs = [landmark.x for landmark in hand_obj_list[0].landmark]
+        ys = [landmark.y for landmark in hand_obj_list[0].landmark]
+        hand_box = (min(xs), min(ys), max(xs), max(ys))
+        if self.box is None or not self._contains(hand_box) or self._too_big(hand_box):
+            self.box = self._box_around(hand_box)
+
+    def _box_around(self, hand_box):
+        x0, y0, x1, y1 = hand_box
+        size = max(x1 - x0, y1 - y0, self.min_size)
+        pad = size * (1 + 2 * self.margin) / 2
+        centre_x, centre_y = (x0 + x1) / 2, (y0 + y1) / 2
+        return (max(0.0, centre_x - pad), max(0.0, centre_y - pad), min(1.0, centre_x + pad), min(1.0, centre_y + pad))
+
+    def _contains(self, hand_box):
+        #only move the box when the hand gets close to its edge, a box that jumps every frame
+        #throws off mediapipe's own tracking
+        x0, y0, x1, y1 = self.box
+        edge = (x1 - x0) * self.margin / 4
+        return (hand_box[0] >= x0 + edge and hand_box[1] >= y0 + edge and
+                hand_box[2] <= x1 - edge and hand_box[3] <= y1 - edge)
+
+    def _too_big(self, hand_box):
+        hand_size = max(hand_box[2] - hand_box[0], hand_box[3] - hand_box[1], self.min_size)
+        return (self.box[2] - self.box[0]) > 2.5 * hand_size * (1 + 2 * self.margin)
+
+#one tracker per mediapipe model, every camera has its own model
+roi_trackers = {}
+
+def get_roi_tracker(hand):
+    if not roi_mode or hands_to_find() > 1: #the crop follows one hand, others would be cut off
+        return None
+    if hand not in roi_trackers:
+        roi_trackers[hand] = RoiTracker(roi_margin)
+    return roi_trackers[hand]
+
+def downscale(image):
+    if input_max_side is None:
+        return image
+    height, width = image.shape[:2]
+    scale = input_max_side / max(height, width)
+    if scale >= 1:
+        return image
+    #normalised landmarks don't change with a uniform resize, so nothing to map back
+    return cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+
+#-----------------------------------------------------------------------------------#
+#                                  Motion gating
+#   compares a tiny greyscale thumbnail of the hand area with the one from the last frame
+#   that went through mediapipe, if it barely changed the last result is reused and nothing
+#   gets written (for up to motion_max_skip frames or motion_max_skip_time), as soon as
+#   something moves inference runs on every frame again
+#-----------------------------------------------------------------------------------#
+class MotionGate:
+    def __init__(self, threshold=1.5, max_skip=15, max_skip_time=0.2, thumbnail_size=(32, 24)):
+        self.threshold = threshold
+        self.max_skip = max_skip
+        self.max_skip_time = max_skip_time
+        self.thumbnail_size = thumbnail_size
+        self.reference = None
+        self.last_result = None
+        self.skipped_in_row = 0
+        self.processed_time = 0.0 #time.monotonic() of the last frame that went through mediapipe
+        self.processed = 0
+        self.skipped = 0
+
+    def thumbnail(self, frame, box=None):
+        if box is not None: #only look at the hand area when the roi tracker has one
+            height, width = frame.shape[:2]
+            x0, y0, x1, y1 = box
+            frame = frame[int(y0 * height):int(np.ceil(y1 * height)), int(x0 * width):int(np.ceil(x1 * width))]
+        grey = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(grey, self.thumbnail_size, interpolation=cv2.INTER_AREA)
+
+    def check(self, frame, box=None):
+        #returns (run inference?, thumbnail)
+        thumbnail = self.thumbnail(frame, box)
+        if (self.last_result is None or self.reference is None or self.skipped_in_row >= self.max_skip
+                or time.monotonic() - self.processed_time >= self.max_skip_time
+                or self.reference.shape != thumbnail.shape):
+            return True, thumbnail
+        motion = cv2.absdiff(thumbnail, self.reference).mean()
+        return motion >= self.threshold, thumbnail
+
+    def processed_frame(self, thumbnail, result):
+        self.reference = thumbnail
+        self.last_result = result
+        self.skipped_in_row = 0
+        self.processed_time = time.monotonic()
+        self.processed += 1
+
+    def skipped_frame(self):
+        self.skipped_in_row += 1
+        self.skipped += 1
+
+#one gate per mediapipe model, every camera has its own model
+motion_gates = {}
+
+def get_motion_gate(hand):
+    if not motion_gating:
+        return None
+    if hand not in motion_gates:
+        motion_gates[hand] = MotionGate(motion_threshold, motion_max_skip, motion_max_skip_time)
+    return motion_gates[hand]
+
+def report_motion_gates():
+    for gate in motion_gates.values():
+        total = gate.processed + gate.skipped
+        if total:
+            print(f'Motion gate: {gate.processed} frames processed, {gate.skipped} skipped '
+                  f'({100 * gate.skipped / total:.0f}% skipped)')
+
 #-----------------------------------------------------------------------------------#
 #                                 Camera functions
 #
 #-----------------------------------------------------------------------------------#
+def load_mediapipe():
+    global mp, mp_draw, mp_hands
+    with mediapipe_lock: #the model threads can get here together
+        if mp is None:
+            start = time.perf_counter()
+            import mediapipe
+            mp_draw = mediapipe.solutions.drawing_utils
+            mp_hands = mediapipe.solutions.hands
+            mp = mediapipe
+            record_startup_step('import mediapipe', start)
+
+def hands_to_find():
+    #enough for every route, so two routed arms don't need max_num_hands changed as well
+    return max(max_num_hands, len(hand_routes)) if hand_routes else max_num_hands
+
+def create_hand():
+    load_mediapipe()
+    return mp_hands.Hands(max_num_hands=hands_to_find(), min_detection_confidence=0.9, min_tracking_confidence=0.9)
+
+def load_model(orientation):
+    #model for one camera, warmed up on a blank frame if warm_up_model is set
+    hand = create_hand()
+    if warm_up_model:
+        start = time.perf_counter()
+        hand.process(np.zeros((480, 640, 3), dtype=np.uint8))
+        record_startup_step(f'{orientation} model warm-up', start)
+    return hand
+
+def open_camera(index, orientation):
+    start = time.perf_counter()
+    cam = open_source(index, f'{orientation.capitalize()} camera', width=camera_width, height=camera_height,
+                      fps=camera_fps, fourcc=camera_fourcc, buffer_size=camera_buffer_size,
+                      drop_stale=drop_stale_frames)
+    record_startup_step(f'{orientation} camera open', start)
+    if cam.isOpened():
+        print(cam.describe())
+    return cam
+
+def report_cameras(*cams):
+    for cam in cams:
+        if cam:
+            cam.report()
+
+def open_camera_and_model(index, orientation):
+    #the camera opens here while the model loads on a thread, both can take seconds
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        hand = pool.submit(load_model, orientation)
+        cam = open_camera(index, orientation)
+        return cam, hand.result()
+
+def open_cameras():
+    global front_cam, back_cam, front_hand, back_hand
+    #only the cameras that are turned on get a model, everything opens at once
+    cameras = [(index, orientation) for index, orientation in ((front_cam_index, 'front'), (back_cam_index, 'back'))
+               if index is not None]
+    with ThreadPoolExecutor(max_workers=2 * len(cameras) or 1) as pool:
+        hands = {orientation: pool.submit(load_model, orientation) for _, orientation in cameras}
+        cams = {orientation: pool.submit(open_camera, index, orientation) for index, orientation in cameras}
+        if 'front' in cams:
+            front_cam, front_hand = cams['front'].result(), hands['front'].result()
+        if 'back' in cams:
+            back_cam, back_hand = cams['back'].result(), hands['back'].result()
+    report_ready('model')
+    if any(is_cam_available(cam) for cam in (front_cam, back_cam) if cam):
+        report_ready('camera')
+
+def record_startup_step(step, start):
+    startup_steps.append((step, start - startup_start, time.perf_counter() - startup_start))
+
+def report_startup_profile():
+    if not startup_profile:
+        return
+    print(f'Startup profile ({time.perf_counter() - startup_start:.2f} s to the first frame):')
+    for step, start, end in sorted(startup_steps, key=lambda step: step[1]):
+        print(f'    {step:<24} {start:6.2f} -> {end:6.2f} s  ({end - start:.2f} s)')
+
+def report_startup_profile_after_first_frame():
+    #on a thread of its own from main, replay and the benchmarks write angles too but have no
+    #startup to profile
+    first_frame_written.wait()
+    report_startup_profile()
+
+def run_model(image, hand):
+    frame_rgb = cv2.cvtColor(downscale(image), cv2.COLOR_BGR2RGB)
+    captured_landmarks = hand.process(frame_rgb)
+    return captured_landmarks.multi_hand_landmarks, captured_landmarks.multi_handedness
+
 def process_frame(frame, hand):
     try:   
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        captured_landmarks = hand.process(frame_rgb)
-        return captured_landmarks.multi_hand_landmarks, captured_landmarks.multi_handedness
+        roi = get_roi_tracker(hand)
+        if roi is None:
+            return run_model(frame, hand)
+
+        region, pixel_box = roi.crop(frame)
+        hand_obj_list, handedness = run_model(region, hand)
+        if not hand_obj_list and pixel_box is not None: #lost it in the crop, try the whole frame straight away
+            pixel_box = None
+            roi.full_frames += 1
+            hand_obj_list, handedness = run_model(frame, hand)
+        roi.update(hand_obj_list, pixel_box, frame.shape)
+        return hand_obj_list, handedness
     except Exception as e:
         print(f'An error occured in process frame: {e}')
         return None, None
 
-def cap_hand(cam, hand, orientation, is_back_camera=False):
+def open_recorder(suffix=''):
+    global landmark_recorder
+    if record_path and landmark_recorder is None:
+        root, extension = os.path.splitext(record_path)
+        landmark_recorder = LandmarkRecorder(f'{root}{suffix}{extension}')
+        print(f'Recording landmarks to {landmark_recorder.path}')
+
+def close_recorder():
+    global landmark_recorder
+    if landmark_recorder is not None:
+        landmark_recorder.close()
+        landmark_recorder = None
+
+def route_hand(hand_type, index=0):
+    #arm for a hand of this type (or the index-th hand found), None when it isn't routed
+    return hand_routes.get(hand_type, hand_routes.get(index))
+
+def route_hands(hand_obj_list, handedness):
+    #arm -> (detected hand, hand type, score) through hand_routes, when two hands land on the
+    #same arm the more confident one drives it
+    routed = {}
+    for index, (detected_hand, hand_info) in enumerate(zip(hand_obj_list, handedness)):
+        hand_type = hand_info.classification[0].label
+        score = hand_info.classification[0].score
+        arm = route_hand(hand_type, index)
+        if arm is not None and (arm not in routed or score > routed[arm][2]):
+            routed[arm] = (detected_hand, hand_type, score)
+    return routed
+
+def track_hand(frame, hand, is_back_camera=False, capture_time=None):
+    #inference and angle math for one frame, returns angles, the detected hand and its type
+    #with hand_routes set they are arm -> angles and lists of every hand found
+    #capture_time is only needed when recording (the first hand found is recorded)
+    hand_obj_list, type = process_frame(frame, hand)
+    camera = 'back' if is_back_camera else 'front'
+    if not hand_obj_list:
+        if landmark_recorder and capture_time:
+            landmark_recorder.record(capture_time, camera)
+        return {}, None, None
+    detected_hand = hand_obj_list[0]
+    hand_type = type[0].classification[0].label
+    if landmark_recorder and capture_time:
+        landmark_recorder.record(capture_time, camera, detected_hand, hand_type, type[0].classification[0].score)
+    if hand_routes:
+        angles = {arm: add_finger_weights(calculate_finger_angles(routed_hand.landmark, routed_type, is_back_camera),
+                                          routed_hand.landmark, score)
+                  for arm, (routed_hand, routed_type, score) in route_hands(hand_obj_list, type).items()}
+        return angles, list(hand_obj_list), [hand_info.classification[0].label for hand_info in type]
+    angles = calculate_finger_angles(detected_hand.landmark, hand_type, is_back_camera)
+    add_finger_weights(angles, detected_hand.landmark, type[0].classification[0].score)
+    return angles, detected_hand, hand_type
+
+def gated_track_hand(frame, hand, is_back_camera=False, capture_time=None):
+    #track_hand behind the motion gate, the extra value is False when the last result was reused
+    gate = get_motion_gate(hand)
+    if gate is None:
+        return (*track_hand(frame, hand, is_back_camera, capture_time), True)
+    roi = roi_trackers.get(hand)
+    run_inference, thumbnail = gate.check(frame, roi.box if roi else None)
+    if not run_inference:
+        gate.skipped_frame()
+        return (*gate.last_result, False)
+    result = track_hand(frame, hand, is_back_camera, capture_time)
+    gate.processed_frame(thumbnail, result)
+    return (*result, True)
+
+def draw_hand(frame, detected_hand, hand_type, orientation):
+    #detected_hand and hand_type are lists when hands are routed to several arms
+    if isinstance(detected_hand, list):
+        for index, (one_hand, one_type) in enumerate(zip(detected_hand, hand_type)):
+            mp_draw.draw_landmarks(frame, one_hand, mp_hands.HAND_CONNECTIONS)
+            cv2.putText(frame, f"Hand: {one_type}", (10, 30 + 35 * index), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+    elif detected_hand is not None:
+        mp_draw.draw_landmarks(frame, detected_hand, mp_hands.HAND_CONNECTIONS)
+        #note that the hand type it detects is actually wrong, idk why that is... bad ai >.>
+        cv2.putText(frame, f"Hand: {hand_type}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+    cv2.imshow(f'{orientation} Camera', frame)
+
+def grab_camera(cam):
+    #(capture start, capture end) of a grabbed frame, None when the grab failed
     try:
-        ret, frame = cam.read()
+        capture_start = time.time()
+        if cam.grab():
+            return capture_start, time.time()
+    except Exception as e:
+        print(f'An error occured in grab_camera: {e}')
+    return None
+
+def cap_hand(cam, hand, orientation, is_back_camera=False, timings=None, frames=None, grabbed=None):
+    #timings: optional dict, gets (capture start, capture end, inference done) under orientation
+    #frames: optional dict, gets (frame, detected hand, hand type) under orientation for show_frames
+    #grabbed: what grab_camera returned when the frame was grabbed already, it is only retrieved then
+    try:
+        if grabbed:
+            capture_start, capture_time = grabbed
+            ret, frame = cam.retrieve()
+        else:
+            capture_start = time.time()
+            ret, frame = cam.read()
+            capture_time = time.time()
         angles = {}
-        hand_type = None
         if ret:
-            hand_obj_list, type = process_frame(frame, hand)
-            if hand_obj_list:
-                hand = hand_obj_list[0]
-                hand_type = type[0].classification[0].label
-                angles = calculate_finger_angles(hand.landmark, hand_type, is_back_camera) 
-                mp_draw.draw_landmarks(frame, hand, mp_hands.HAND_CONNECTIONS)
-                #note that the hand type it detects is actually wrong, idk why that is... bad ai >.>
-                cv2.putText(frame, f"Hand: {hand_type}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-            cv2.imshow(f'{orientation} Camera', frame)
+            angles, detected_hand, hand_type, processed = gated_track_hand(frame, hand, is_back_camera, capture_time)
+            if processed and timings is not None:
+                timings[orientation] = (capture_start, capture_time, time.time())
+            if frames is not None:
+                frames[orientation] = (frame, detected_hand, hand_type)
         return angles
     
     except Exception as e:
         print(f'An error occured in cap_hand: {e}')
         return {}
 
+def frame_timing(timings):
+    #combined timing for angles fused from several cameras, oldest capture and last inference
+    if not timings:
+        return None
+    return (min(timing[0] for timing in timings), min(timing[1] for timing in timings),
+            max(timing[2] for timing in timings))
+
+def select_angles(angles, capture_times=None):
+    #pick what gets written from the per camera angles, per arm when hands are routed
+    #capture_times: optional camera -> when its frame was captured, for fuse_angles
+    if hand_routes:
+        arms = {arm for camera_angles in angles.values() for arm in camera_angles}
+        return {arm: select_camera_angles({camera: camera_angles[arm] for camera, camera_angles in angles.items()
+                                           if arm in camera_angles}, capture_times)
+                for arm in arms}
+    return select_camera_angles(angles, capture_times)
+
+def select_camera_angles(angles, capture_times=None):
+    if 'front' in angles and 'back' in angles:
+        capture_times = capture_times or {}
+        return fuse_angles(angles['front'], angles['back'], capture_times.get('front'), capture_times.get('back'))
+    elif 'front' in angles:
+        return strip_weights(angles['front'])
+    elif 'back' in angles:
+        return strip_weights(angles['back'])
+    return {}
+
 def capture_loop():
     try:
-        while True:
+        while not stop_event.is_set():
+            if not any(is_cam_available(cam) for cam in (front_cam, back_cam) if cam):
+                print('No camera available (or the video ended), stopping')
+                break
             angles = {}
-            if front_cam:
-                if is_cam_available(front_cam):
-                    angles['front'] = cap_hand(front_cam, front_hand, 'Front')
-
-            if back_cam: 
-                if is_cam_available(back_cam):
-                    angles['back'] = cap_hand(back_cam, back_hand, 'Back', is_back_camera=True) 
+            timings = {}
+            frames = {}
+            cameras = [(cam, hand, orientation, is_back_camera) for cam, hand, orientation, is_back_camera in
+                       ((front_cam, front_hand, 'Front', False), (back_cam, back_hand, 'Back', True))
+                       if cam and is_cam_available(cam)]
+            #grab every camera before inference on any of them, otherwise the back frame is taken a
+            #whole front inference later and often lands outside fusion_tolerance
+            grabbed = {orientation: grab_camera(cam) for cam, _, orientation, _ in cameras}
+            for cam, hand, orientation, is_back_camera in cameras:
+                if grabbed[orientation]:
+                    angles[orientation.lower()] = cap_hand(cam, hand, orientation, is_back_camera, timings, frames,
+                                                           grabbed[orientation])
+                else:
+                    angles[orientation.lower()] = {}
 
-            if angles:
-                if 'front' in angles.keys() and 'back' in angles.keys():
-                    angles_to_write = average_angles(angles['front'], angles['back'])
-                elif 'front':
-                    angles_to_write = angles['front']
-                elif 'back':
-                    angles_to_write = angles['back']
+            #with motion gating nothing is written when every camera reused its last result
+            if angles and (timings or not motion_gating):
+                angles_to_write = select_angles(angles, {orientation.lower(): timing[1] for orientation, timing in timings.items()})
                 
                 if angles_to_write:
-                    write_angles(angles_to_write)
+                    write_angles(angles_to_write, frame_timing(timings.values()))
                 
                 else:
                     write_angles({})
 
-            if cv2.waitKey(1) & 0xFF == ord('q'):
+            if show_frames(frames):
                 break
     except Exception as e:
         print(f'An error occured in capture_loop: {e}')
 
+#-----------------------------------------------------------------------------------#
+#                                Pipelined capture
+#   grab -> inference -> output -> render each run on their own thread, the hand offs
+#   only ever hold the newest item so a slow stage drops stale frames instead of
+#   queueing them up
+#-----------------------------------------------------------------------------------#
+class LatestSlot:
+    #bounded queue of size one, putting a new item replaces one that was never taken
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._item = None
+        self._has_item = False
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        with self._condition:
+            if self._has_item:
+                self.dropped += 1
+            self._item = item
+            self._has_item = True
+            self._condition.notify_all()
+
+    def get(self, timeout=None):
+        #returns None on timeout or once the slot is closed
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._has_item or self._closed, timeout):
+                return None
+            if not self._has_item:
+                return None
+            item = self._item
+            self._item = None
+            self._has_item = False
+            return item
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
+
+def grab_stage(cam, frame_slot, stop_event):
+    #keeps reading so the driver buffer never fills up with old frames
+    while not stop_event.is_set():
+        try:
+            capture_start = time.time()
+            ret, frame = cam.read()
+            if ret:
+                frame_slot.put((capture_start, time.time(), frame))
+            elif not is_cam_available(cam): #unplugged, or the end of a video file
+                break
+        except Exception as e:
+            print(f'An error occured in grab_stage: {e}')
+    frame_slot.close()
+
+def inference_stage(cameras, result_slot, stop_event):
+    #cameras: list of (orientation, frame slot, hand, is_back_camera)
+    while not stop_event.is_set():
+        try:
+            #every grab stage has stopped, a closed slot never waits so don't spin on them
+            if all(frame_slot.closed for _, frame_slot, _, _ in cameras):
+                print('No camera available (or the video ended), stopping')
+                stop_event.set()
+                break
+            angles = {}
+            frames = {}
+            timings = {}
+            for orientation, frame_slot, hand, is_back_camera in cameras:
+                grabbed = frame_slot.get(timeout=0.5)
+                if grabbed is None:
+                    continue
+                capture_start, capture_time, frame = grabbed
+                cam_angles, detected_hand, hand_type, processed = gated_track_hand(frame, hand, is_back_camera, capture_time)
+                if processed:
+                    timings[orientation.lower()] = (capture_start, capture_time, time.time())
+                angles[orientation.lower()] = cam_angles
+                frames[orientation] = (frame, detected_hand, hand_type)
+            if angles:
+                result_slot.put((angles, frames, timings, bool(timings)))
+        except Exception as e:
+            print(f'An error occured in inference_stage: {e}')
+    result_slot.close()
+
+def output_stage(result_slot, render_slot, stop_event):
+    while not stop_event.is_set():
+        try:
+            result = result_slot.get(timeout=0.5)
+            if result is None:
+                continue
+            angles, frames, timings, processed = result
+            if processed or not motion_gating:
+                capture_times = {camera: timing[1] for camera, timing in timings.items()}
+                write_angles(select_angles(angles, capture_times), frame_timing(list(timings.values())))
+            render_slot.put(frames)
+        except Exception as e:
+            print(f'An error occured in output_stage: {e}')
+    render_slot.close()
+
+def pipelined_capture_loop():
+    pipeline_stop = threading.Event()
+    cameras = []
+    threads = []
+    for cam, hand, orientation, is_back_camera in ((front_cam, front_hand, 'Front', False),
+                                                   (back_cam, back_hand, 'Back', True)):
+        if cam and is_cam_available(cam):
+            frame_slot = LatestSlot()
+            cameras.append((orientation, frame_slot, hand, is_back_camera))
+            threads.append(threading.Thread(target=grab_stage, args=(cam, frame_slot, pipeline_stop), daemon=True))
+
+    result_slot = LatestSlot()
+    render_slot = LatestSlot()
+    threads.append(threading.Thread(target=inference_stage, args=(cameras, result_slot, pipeline_stop), daemon=True))
+    threads.append(threading.Thread(target=output_stage, args=(result_slot, render_slot, pipeline_stop), daemon=True))
+    for thread in threads:
+        thread.start()
+
+    #rendering stays on the main thread, opencv windows are not thread safe everywhere
+    try:
+        while not pipeline_stop.is_set():
+            frames = render_slot.get(timeout=0.05)
+            if show_frames(frames or {}):
+                break
+    except Exception as e:
+        print(f'An error occured in pipelined_capture_loop: {e}')
+    finally:
+        pipeline_stop.set()
+        for thread in threads:
+            thread.join(timeout=1)
+        dropped = sum(frame_slot.dropped for _, frame_slot, _, _ in cameras)
+        print(f'Pipeline dropped {dropped} stale camera frames, {result_slot.dropped} results and {render_slot.dropped} renders')
+
+#-----------------------------------------------------------------------------------#
+#                                     Display
+#   windows and drawing cost a few ms per frame, headless mode leaves them out. the
+#   optional preview draws a frame now and then on its own thread so it never holds
+#   up tracking
+#-----------------------------------------------------------------------------------#
+class Preview:
+    def __init__(self, rate_hz):
+        self.period = 1 / rate_hz
+        self._slot = LatestSlot()
+        self._last_offer = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def offer(self, frames):
+        #only taken when the next preview is due, the frames are not copied
+        now = time.monotonic()
+        if frames and now - self._last_offer >= self.period:
+            self._last_offer = now
+            self._slot.put(frames)
+
+    def _run(self):
+        #every window call for the preview happens on this thread
+        try:
+            while not stop_event.is_set():
+                frames = self._slot.get(timeout=self.period)
+                for orientation, (frame, detected_hand, hand_type) in (frames or {}).items():
+                    draw_hand(frame, detected_hand, hand_type, orientation)
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    request_stop()
+        except Exception as e:
+            print(f'An error occured in the preview: {e}')
+        finally:
+            cv2.destroyAllWindows()
+
+    def close(self):
+        self._slot.close()
+        self._thread.join(timeout=1)
+
+def show_frames(frames):
+    #frames: orientation -> (frame, detected hand, hand type)
+    #returns True when it's time to stop ('q' pressed in a window or stop requested)
+    if headless:
+        if preview:
+            preview.offer(frames)
+        return stop_event.is_set()
+    for orientation, (frame, detected_hand, hand_type) in frames.items():
+        draw_hand(frame, detected_hand, hand_type, orientation)
+    if cv2.waitKey(1) & 0xFF == ord('q'):
+        request_stop()
+    return stop_event.is_set()
+
+def close_display():
+    global preview
+    if preview:
+        preview.close()
+        preview = None
+    elif not headless:
+        cv2.destroyAllWindows()
+
+def request_stop(signum=None, frame=None):
+    stop_event.set()
+
+def install_stop_handlers():
+    #ctrl+c and SIGTERM (e.g. from a supervisor) end the capture loop cleanly, needed when there is no window
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+    if hasattr(signal, 'SIGBREAK'): #what the supervisor sends on windows
+        signal.signal(signal.SIGBREAK, request_stop)
+
+#-----------------------------------------------------------------------------------#
+#                              Process per camera capture
+#   each camera gets its own process with its own mediapipe model so two cameras run
+#   on two cores, results come back with their capture time for the fusion step
+#-----------------------------------------------------------------------------------#
+def put_newest(result_queue, item):
+    #drop the oldest result instead of blocking when the main process falls behind
+    while True:
+        try:
+            result_queue.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                result_queue.get_nowait()
+            except queue.Empty:
+                pass
+
+def camera_worker(cam_index, orientation, is_back_camera, result_queue, stop_event):
+    global preview
+    cam = None
+    try:
+        signal.signal(signal.SIGINT, signal.SIG_IGN) #the main process stops us through stop_event
+        if headless and preview_rate_hz > 0:
+            preview = Preview(preview_rate_hz)
+        cam, hand = open_camera_and_model(cam_index, orientation)
+        report_ready('model')
+        if is_cam_available(cam):
+            report_ready('camera')
+        open_recorder(f'_{orientation}') #one file per worker process
+        profile_pending = True
+        while not stop_event.is_set() and is_cam_available(cam):
+            capture_start = time.time()
+            ret, frame = cam.read()
+            capture_time = time.time()
+            if not ret:
+                continue
+            angles, detected_hand, hand_type, processed = gated_track_hand(frame, hand, is_back_camera, capture_time)
+            if processed:
+                put_newest(result_queue, (orientation, (capture_start, capture_time, time.time()), angles))
+                if profile_pending: #this process's own camera and model
+                    profile_pending = False
+                    report_startup_profile()
+
+            #each process shows its own window, 'q' in any of them stops everything
+            if show_frames({orientation.capitalize(): (frame, detected_hand, hand_type)}):
+                stop_event.set()
+    except Exception as e:
+        print(f'An error occured in camera_worker ({orientation}): {e}')
+    finally:
+        if cam:
+            cam.release()
+            report_cameras(cam)
+        report_motion_gates()
+        close_recorder()
+        close_display()
+
+def fuse_latest(latest, now):
+    #latest: orientation -> (timing, angles), stale cameras are ignored
+    #returns the fused angles and their combined timing
+    fresh = {orientation: (timing, angles) for orientation, (timing, angles) in latest.items()
+             if now - timing[1] <= camera_result_max_age}
+    angles = select_angles({orientation: angles for orientation, (_, angles) in fresh.items()},
+                           {orientation: timing[1] for orientation, (timing, _) in fresh.items()})
+    return angles, frame_timing([timing for timing, _ in fresh.values()])
+
+def process_capture_loop():
+    worker_stop = multiprocessing.Event()
+    cameras = [(index, orientation, is_back_camera) for index, orientation, is_back_camera in
+               ((front_cam_index, 'front', False), (back_cam_index, 'back', True)) if index is not None]
+    result_queue = multiprocessing.Queue(maxsize=2 * len(cameras))
+    workers = [multiprocessing.Process(target=camera_worker, args=(index, orientation, is_back_camera, result_queue, worker_stop), daemon=True)
+               for index, orientation, is_back_camera in cameras]
+    for worker in workers:
+        worker.start()
+
+    latest = {}
+    try:
+        while not stop_event.is_set() and not worker_stop.is_set() and any(worker.is_alive() for worker in workers):
+            try:
+                orientation, timing, angles = result_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            latest[orientation] = (timing, angles)
+            write_angles(*fuse_latest(latest, time.time()))
+        if worker_stop.is_set(): #'q' in a worker's window
+            request_stop()
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(f'An error occured in process_capture_loop: {e}')
+    finally:
+        worker_stop.set()
+        for worker in workers:
+            worker.join(timeout=2)
+            if worker.is_alive():
+                worker.terminate()
+
 #-----------------------------------------------------------------------------------#
 #                                  Main Thread
 #
 #-----------------------------------------------------------------------------------#
 def main():
+    global preview
     try:
         print('Starting...')
-        capture_loop()
+        install_stop_handlers()
+        if headless and preview_rate_hz > 0 and not process_per_camera: #workers start their own
+            preview = Preview(preview_rate_hz)
+        if process_per_camera:
+            process_capture_loop()
+        else:
+            threading.Thread(target=report_startup_profile_after_first_frame, daemon=True).start()
+            open_cameras()
+            open_recorder()
+            if pipeline_mode:
+                pipelined_capture_loop()
+            else:
+                capture_loop()
     except Exception as e:
         print(f'An error occured in main: {e}')
     finally:
@@ -291,9 +1236,17 @@ def main():
             front_cam.release()
         if back_cam:
             back_cam.release()
-        cv2.destroyAllWindows()
+        close_display()
+        report_cameras(front_cam, back_cam)
+        report_motion_gates()
         clear_files()
+        close_angle_channel()
+        close_recorder()
+    #0 when we were asked to stop, anything else (a camera going away, an error) is a crash the
+    #supervisor restarts us after
+    return 0 if stop_event.is_set() else 1
 
 if __name__ == '__main__':
-    main()
+    exit_code = main()
     print('Program complete xx')
+    sys.exit(exit_code)
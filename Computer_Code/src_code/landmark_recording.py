@@ -0,0 +1,213 @@
+import argparse, os, struct, sys, time
+import numpy as np
+#record and replay of raw mediapipe landmark streams
+#
+#a recording is an append only binary file: a small header then fixed size records (see
+#RECORD_DTYPE), one per camera frame including frames where no hand was found. replay maps
+#the file with np.memmap so nothing is loaded into ram up front and every frame/chunk handed
+#out is a view into the file, so multi hour recordings are fine
+#
+#record: set record_path in hand_tracking.py and run tracking as normal
+#replay: python landmark_recording.py replay session.bapr [--fast] [--speed 2]
+#info:   python landmark_recording.py info session.bapr
+
+MAGIC = b'BAPLMREC'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sHHI48x') #magic, version, camera count (unused, 0), record size, padding to 64 bytes
+
+NUM_LANDMARKS = 21
+CAMERAS = ['front', 'back']
+HANDEDNESS = [None, 'Left', 'Right'] #0 means no hand in that frame
+
+RECORD_DTYPE = np.dtype([
+    ('timestamp', '<f8'), #time.time() when the camera frame was read
+    ('camera', 'u1'), #index into CAMERAS
+    ('handedness', 'u1'), #index into HANDEDNESS
+    ('score', '<f4'), #handedness confidence
+    ('landmarks', '<f4', (NUM_LANDMARKS, 3)), #normalised x, y, z
+])
+
+#-----------------------------------------------------------------------------------#
+#                                    Recording
+#
+#-----------------------------------------------------------------------------------#
+class LandmarkRecorder:
+    def __init__(self, path, flush_every=30):
+        self.path = path
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not new_file:
+            check_header(path)
+        self._file = open(path, 'ab')
+        if new_file:
+            self._file.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, RECORD_DTYPE.itemsize))
+        self._record = np.zeros(1, dtype=RECORD_DTYPE)
+        self._flush_every = flush_every
+        self.count = 0
+
+    def record(self, timestamp, camera, detected_hand=None, hand_type=None, score=0.0):
+        #detected_hand: mediapipe landmark list (or a (21, 3) array), None when no hand was found
+        record = self._record[0]
+        record['timestamp'] = timestamp
+        record['camera'] = CAMERAS.index(camera)
+        if detected_hand is None:
+            record['handedness'] = 0
+            record['score'] = 0.0
+            record['landmarks'] = 0.0
+        else:
+            landmarks = detected_hand if isinstance(detected_hand, np.ndarray) else \
+                [(lm.x, lm.y, lm.z) for lm in detected_hand.landmark]
+            record['handedness'] = HANDEDNESS.index(hand_type)
+            record['score'] = score
+            record['landmarks'] = landmarks
+        self._file.write(self._record.tobytes())
+        self.count += 1
+        if self.count % self._flush_every == 0:
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+#-----------------------------------------------------------------------------------#
+#                                     Replay
+#
+#-----------------------------------------------------------------------------------#
+class Pacer:
+    #sleeps so recorded timestamps come out with their original spacing (divided by speed)
+    def __init__(self, speed=1.0):
+        self.speed = speed
+        self._start = None
+        self._first_timestamp = None
+
+    def wait(self, timestamp):
+        if self._start is None:
+            self._start = time.perf_counter()
+            self._first_timestamp = timestamp
+            return
+        delay = (timestamp - self._first_timestamp) / self.speed - (time.perf_counter() - self._start)
+        if delay > 0:
+            time.sleep(delay)
+
+def check_header(path):
+    with open(path, 'rb') as file:
+        header = file.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise ValueError(f'{path} is too short to be a landmark recording')
+    magic, version, _, record_size = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError(f'{path} is not a landmark recording')
+    if version != FORMAT_VERSION or record_size != RECORD_DTYPE.itemsize:
+        raise ValueError(f'{path} is recording format {version} ({record_size} byte records), expected '
+                         f'{FORMAT_VERSION} ({RECORD_DTYPE.itemsize} bytes)')
+
+class LandmarkRecording:
+    def __init__(self, path):
+        check_header(path)
+        self.path = path
+        #a partly written last record (recording killed mid write) is left out
+        count = (os.path.getsize(path) - HEADER.size) // RECORD_DTYPE.itemsize
+        if count:
+            self.records = np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER.size, shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=RECORD_DTYPE)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        return self.records[index]
+
+    def duration(self):
+        if not len(self):
+            return 0.0
+        return float(self.records['timestamp'][-1] - self.records['timestamp'][0])
+
+    def chunks(self, chunk_size=1024, start=0, stop=None):
+        #views of chunk_size records at a time
+        stop = len(self) if stop is None else min(stop, len(self))
+        for chunk_start in range(start, stop, chunk_size):
+            yield self.records[chunk_start:min(chunk_start + chunk_size, stop)]
+
+    def frames(self, realtime=True, speed=1.0, chunk_size=1024):
+        #yields one record view at a time, with realtime it sleeps to keep the recorded spacing
+        pacer = Pacer(speed)
+        for chunk in self.chunks(chunk_size):
+            for record in chunk:
+                if realtime:
+                    pacer.wait(record['timestamp'])
+                yield record
+
+def replay(path, realtime=True, speed=1.0, chunk_size=1024):
+    #feeds a recording back through the angle math and publishes the angles like live tracking
+    import hand_tracking
+
+    recording = LandmarkRecording(path)
+    print(f'Replaying {len(recording)} frames ({recording.duration():.1f} s) from {path}')
+    latest = {}
+    published = 0
+    pacer = Pacer(speed)
+    start = time.perf_counter()
+    try:
+        for chunk in recording.chunks(chunk_size):
+            #angles for the whole chunk in one go, then publish them with the recorded pacing
+            has_hand = chunk['handedness'] != 0
+            hand_types = np.array(HANDEDNESS, dtype=object)[chunk['handedness']]
+            angles = [{} for _ in range(len(chunk))]
+            for camera_index, camera in enumerate(CAMERAS):
+                rows = np.nonzero(has_hand & (chunk['camera'] == camera_index))[0]
+                if len(rows):
+                    camera_angles = hand_tracking.calculate_finger_angles_batch(
+                        chunk['landmarks'][rows], hand_types[rows].tolist(), is_back_camera=camera == 'back')
+                    for row, row_angles in zip(rows, camera_angles):
+                        angles[row] = row_angles
+
+            for record, record_angles in zip(chunk, angles):
+                if realtime:
+                    pacer.wait(record['timestamp'])
+                if hand_tracking.hand_routes: #only the first hand is recorded, route it like track_hand would
+                    arm = hand_tracking.route_hand(HANDEDNESS[record['handedness']])
+                    record_angles = {arm: record_angles} if record_angles and arm is not None else {}
+                #fuse on the recorded capture times so fusion_tolerance and camera_result_max_age see
+                #how far apart the frames really were, publish with the replay time like live tracking
+                timestamp = float(record['timestamp'])
+                latest[CAMERAS[record['camera']]] = ((timestamp, timestamp, timestamp), record_angles)
+                fused, _ = hand_tracking.fuse_latest(latest, timestamp)
+                now = time.time()
+                hand_tracking.write_angles(fused, (now, now, now))
+                published += 1
+    except KeyboardInterrupt:
+        print('Replay stopped')
+    finally:
+        hand_tracking.clear_files()
+        hand_tracking.close_angle_channel()
+    elapsed = time.perf_counter() - start
+    print(f'Published {published} frames in {elapsed:.1f} s ({published / max(elapsed, 1e-9):.0f} frames/s)')
+
+def print_info(path):
+    recording = LandmarkRecording(path)
+    records = recording.records
+    print(f'{path}: {len(recording)} frames, {recording.duration():.1f} s, '
+          f'{RECORD_DTYPE.itemsize} bytes per frame')
+    for camera_index, camera in enumerate(CAMERAS):
+        camera_records = records['camera'] == camera_index
+        if camera_records.any():
+            with_hand = (records['handedness'][camera_records] != 0).sum()
+            print(f'  {camera}: {camera_records.sum()} frames, {with_hand} with a hand')
+
+def main():
+    parser = argparse.ArgumentParser(description='landmark recordings')
+    commands = parser.add_subparsers(dest='command', required=True)
+    replay_parser = commands.add_parser('replay', help='publish a recording as if it was live tracking')
+    replay_parser.add_argument('path')
+    replay_parser.add_argument('--fast', action='store_true', help='as fast as possible instead of recorded speed')
+    replay_parser.add_argument('--speed', type=float, default=1.0, help='playback speed multiplier')
+    info_parser = commands.add_parser('info', help='summary of a recording')
+    info_parser.add_argument('path')
+    args = parser.parse_args()
+
+    if args.command == 'replay':
+        replay(args.path, realtime=not args.fast, speed=args.speed)
+    else:
+        print_info(args.path)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,76 @@
+import time
+from collections import deque, OrderedDict
+#per hop latency from camera frame to servo command
+#
+#hand tracking stamps each frame with when the camera read started and finished and when
+#inference was done (see angle_channel.py), the bluetooth client sends the frame with a trace
+#id and the esp32 acks it back with how long it took to set the servos. all host times are
+#time.time() so they line up between the hand tracking and bluetooth processes
+#
+#hops (milliseconds):
+#   capture   : cam.read()
+#   inference : mediapipe + angle math
+#   ipc       : inference done until the ble write starts (shared memory, wake up, send tick)
+#   ble       : one way link time, estimated as (ack round trip - actuation) / 2
+#   actuation : esp32 receiving the frame until the servos are set
+#   total     : camera read start until the servos are set
+
+HOPS = ['capture', 'inference', 'ipc', 'ble', 'actuation', 'total']
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+class LatencyTracker:
+    def __init__(self, max_samples=2000, max_pending=256):
+        self.samples = {hop: deque(maxlen=max_samples) for hop in HOPS}
+        self.max_pending = max_pending
+        self._pending = OrderedDict() #trace id -> (frame, write time)
+        self.sent = 0
+        self.acked = 0
+
+    def frame_sent(self, trace_id, frame, write_time=None):
+        write_time = time.time() if write_time is None else write_time
+        self._pending[trace_id] = (frame, write_time)
+        self._pending.move_to_end(trace_id)
+        while len(self._pending) > self.max_pending: #never acked, the packet or the ack was lost
+            self._pending.popitem(last=False)
+        self.sent += 1
+
+    def ack_received(self, trace_id, actuation_us, receive_time=None):
+        receive_time = time.time() if receive_time is None else receive_time
+        pending = self._pending.pop(trace_id, None)
+        if pending is None:
+            return
+        frame, write_time = pending
+        self.acked += 1
+
+        actuation = actuation_us / 1000
+        ble = max(0.0, ((receive_time - write_time) * 1000 - actuation) / 2)
+        self.samples['ble'].append(ble)
+        self.samples['actuation'].append(actuation)
+
+        if frame.capture_start: #0 when hand tracking didn't stamp the frame
+            self.samples['capture'].append((frame.capture_time - frame.capture_start) * 1000)
+            self.samples['inference'].append((frame.inference_time - frame.capture_time) * 1000)
+            self.samples['ipc'].append((write_time - frame.inference_time) * 1000)
+            self.samples['total'].append((write_time - frame.capture_start) * 1000 + ble + actuation)
+
+    def summary(self):
+        #hop -> {'count', 'p50', 'p95', 'p99'} in milliseconds
+        result = {}
+        for hop, values in self.samples.items():
+            ordered = sorted(values)
+            result[hop] = {'count': len(ordered),
+                           'p50': percentile(ordered, 0.50),
+                           'p95': percentile(ordered, 0.95),
+                           'p99': percentile(ordered, 0.99)}
+        return result
+
+    def report(self):
+        print(f"Latency ({self.acked}/{self.sent} frames acked), ms p50 / p95 / p99:")
+        for hop, stats in self.summary().items():
+            if stats['count']:
+                print(f"  {hop:<10}{stats['p50']:8.1f}{stats['p95']:8.1f}{stats['p99']:8.1f}   ({stats['count']} samples)")
@@ -0,0 +1,173 @@
+import os, signal, subprocess, sys, threading, time
+#starts hand tracking and the bluetooth client and keeps them running
+#   python supervisor.py
+#
+#instead of waiting a fixed time for the computer vision to load, each worker prints a readiness
+#line (see report_ready) when it gets through a startup stage: hand tracking after the model is
+#loaded, the cameras are open and the first frame has been through the model, the client once it is
+#connected to the esp32. the supervisor reads every line the workers print (so a full pipe
+#never blocks them), passes the rest through with the worker's name in front and prints how
+#long each stage took
+#
+#a worker that crashes is started again on its own after a short backoff, the other one keeps
+#running: the client stays connected while hand tracking restarts and picks the new angle
+#channel up by itself. a worker that stops on purpose (exit code 0: 'q' in the preview, 'g' or
+#the esp32 shutting down) stops everything
+
+READY_PREFIX = 'BAP-READY '
+SUPERVISED_ENV = 'BAP_SUPERVISED' #set for the workers, report_ready only prints when it's there
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+TRACKING_STAGES = ['model', 'camera', 'frame']
+CLIENT_STAGES = ['connected']
+STARTUP_TIMEOUT = 60 #seconds before a worker that isn't ready is reported
+RESTART_BACKOFF = [1, 2, 5, 10] #seconds before each restart in a row
+MAX_RESTARTS = 5 #crashes within RESTART_WINDOW before giving up
+RESTART_WINDOW = 60
+STOP_TIMEOUT = 5 #seconds a worker gets to stop before it is killed
+
+def report_ready(stage):
+    #called by a worker when it gets through a startup stage
+    if os.environ.get(SUPERVISED_ENV):
+        print(f'{READY_PREFIX}{stage}', flush=True)
+
+class Worker:
+    def __init__(self, name, script, stages):
+        self.name = name
+        self.script = script
+        self.stages = stages
+        self.process = None
+        self.ready = {stage: threading.Event() for stage in stages}
+        self.started = 0.0
+        self.crashes = [] #times of recent crashes
+        self.restart_at = None #when a crashed worker gets started again
+        self._reader = None
+
+    def start(self):
+        env = dict(os.environ)
+        env[SUPERVISED_ENV] = '1'
+        #own process group so ctrl+c only reaches the supervisor, it decides who stops
+        if os.name == 'nt':
+            group = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+        else:
+            group = {'start_new_session': True}
+        for event in self.ready.values():
+            event.clear()
+        self.started = time.perf_counter()
+        self.restart_at = None
+        self.process = subprocess.Popen([sys.executable, '-u', os.path.join(SRC_DIR, self.script)],
+                                        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                                        text=True, errors='replace', bufsize=1, cwd=SRC_DIR, env=env, **group)
+        self._reader = threading.Thread(target=self._read_output, args=(self.process,), daemon=True)
+        self._reader.start()
+        print(f'[supervisor] started {self.name} (pid {self.process.pid})')
+
+    def _read_output(self, process):
+        for line in process.stdout:
+            line = line.rstrip('\n')
+            if line.startswith(READY_PREFIX):
+                stage = line[len(READY_PREFIX):].strip()
+                if stage in self.ready and not self.ready[stage].is_set():
+                    self.ready[stage].set()
+                    print(f'[supervisor] {self.name}: {stage} ready after {time.perf_counter() - self.started:.1f} s')
+            else:
+                print(f'[{self.name}] {line}', flush=True)
+        process.stdout.close()
+
+    def is_ready(self):
+        return all(event.is_set() for event in self.ready.values())
+
+    def missing_stages(self):
+        return [stage for stage in self.stages if not self.ready[stage].is_set()]
+
+    def poll(self):
+        #exit code once the process has ended, None while it runs
+        return self.process.poll() if self.process else None
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        process = self.process
+        if not process or process.poll() is not None:
+            return
+        try:
+            if os.name == 'nt':
+                process.send_signal(signal.CTRL_BREAK_EVENT)
+            else:
+                process.send_signal(signal.SIGINT) #both workers shut down cleanly on ctrl+c
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            print(f'[supervisor] {self.name} did not stop, killing it')
+            process.kill()
+            process.wait()
+        except OSError:
+            pass
+        if self._reader:
+            self._reader.join(1)
+
+    def crashed(self, now):
+        #returns the seconds until the restart, None when it crashed too often
+        self.crashes = [t for t in self.crashes if now - t < RESTART_WINDOW] + [now]
+        for event in self.ready.values():
+            event.clear()
+        if len(self.crashes) > MAX_RESTARTS:
+            return None
+        delay = RESTART_BACKOFF[min(len(self.crashes), len(RESTART_BACKOFF)) - 1]
+        self.restart_at = now + delay
+        return delay
+
+def supervise(workers):
+    waiting_since = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    all_ready = False
+    warned = set()
+    while True:
+        time.sleep(0.1)
+        now = time.perf_counter()
+        if not all_ready and all(worker.is_ready() for worker in workers):
+            all_ready = True
+            print(f'[supervisor] everything ready after {now - waiting_since:.1f} s')
+
+        for worker in workers:
+            if worker.restart_at is not None:
+                if now >= worker.restart_at:
+                    worker.start()
+                continue
+
+            code = worker.poll()
+            if code is None:
+                if not worker.is_ready() and now - worker.started > STARTUP_TIMEOUT and worker.started not in warned:
+                    warned.add(worker.started)
+                    print(f'[supervisor] {worker.name} still waiting on {", ".join(worker.missing_stages())} '
+                          f'after {STARTUP_TIMEOUT} s')
+                continue
+            if code == 0:
+                print(f'[supervisor] {worker.name} stopped, stopping everything')
+                return True
+
+            delay = worker.crashed(now)
+            if delay is None:
+                print(f'[supervisor] {worker.name} crashed {len(worker.crashes)} times in {RESTART_WINDOW} s, giving up')
+                return False
+            print(f'[supervisor] {worker.name} exited with code {code}, restarting in {delay} s')
+            all_ready = False
+            waiting_since = now
+
+def main():
+    workers = [Worker('tracking', 'hand_tracking.py', TRACKING_STAGES),
+               Worker('bluetooth', 'bluetooth_client.py', CLIENT_STAGES)]
+    ok = False
+    try:
+        ok = supervise(workers)
+    except KeyboardInterrupt:
+        print('[supervisor] stopping...')
+        ok = True
+    except Exception as e:
+        print(f'An error occured in supervisor: {e}')
+    finally:
+        #client first so it disconnects from the esp32 while it still gets angles
+        for worker in reversed(workers):
+            worker.stop()
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
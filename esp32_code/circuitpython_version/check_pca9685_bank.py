@@ -0,0 +1,60 @@
+import sys
+from pca9685_bank import ServoBank, LED0_ON_L, CHANNELS
+#runs on the computer, not the board: python check_pca9685_bank.py
+#drives a ServoBank against a bus that records every i2c transaction and checks that a full
+#hand update goes out as one write with the right registers, and that flush() with nothing
+#changed writes nothing
+
+class RecordingBus:
+    #stands in for adafruit_bus_device's I2CDevice, keeps a copy of every write
+    def __init__(self):
+        self.writes = []
+        self.transactions = 0
+
+    def __enter__(self):
+        self.transactions += 1
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def write(self, buffer, start=0, end=None):
+        self.writes.append(bytes(buffer[start:len(buffer) if end is None else end]))
+
+def registers(write):
+    #channel -> off count for every channel in one burst write
+    first = (write[0] - LED0_ON_L) // 4
+    return {first + index // 4: write[index + 3] | write[index + 4] << 8 for index in range(0, len(write) - 1, 4)}
+
+def main():
+    bus = RecordingBus()
+    bank = ServoBank(bus)
+
+    #full hand update, every channel moves
+    counts = {channel: 205 + 25 * channel for channel in range(CHANNELS)}
+    for channel, count in counts.items():
+        bank.set_count(channel, count)
+    assert bank.flush()
+    assert bus.transactions == 1 and len(bus.writes) == 1, f'{len(bus.writes)} writes for one update'
+    assert bus.writes[0][0] == LED0_ON_L and len(bus.writes[0]) == 1 + 4 * CHANNELS
+    assert registers(bus.writes[0]) == counts
+
+    #nothing changed, nothing written
+    for channel, count in counts.items():
+        bank.set_count(channel, count)
+    assert not bank.flush()
+    assert len(bus.writes) == 1
+
+    #two channels apart move, one write from the first to the last of them
+    bank.set_count(3, 300)
+    bank.set_count(9, 400)
+    assert bank.flush()
+    assert len(bus.writes) == 2
+    assert registers(bus.writes[1]) == {**{channel: counts[channel] for channel in range(3, 10)}, 3: 300, 9: 400}
+    assert bank.writes == 2
+
+    print(f'ok: {len(bus.writes)} i2c writes for 3 flushes (one with nothing changed)')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
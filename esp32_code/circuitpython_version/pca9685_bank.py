@@ -0,0 +1,61 @@
+#pca9685 servo channels written in bursts
+#
+#each channel has 4 registers from LED0_ON_L + 4 * channel: on count (low, high byte) then off
+#count (low, high byte), counts are 12 bit out of 4096 per pwm period. with auto increment on
+#(adafruit_pca9685 turns it on when pca.frequency is set) one i2c write starting at the first
+#changed channel fills every register up to the last changed one, so a whole hand update is a
+#single bus transaction and nothing has to sleep between servos
+#
+#set_count only marks the channel and flush() does the write, the angle -> count conversion is
+#servo_control's (pulse_to_count in the server). check_pca9685_bank.py checks the one write per
+#flush against a recording bus on the computer
+
+LED0_ON_L = 0x06
+MODE1 = 0x00
+MODE1_AI = 0x20 #auto increment bit
+CHANNELS = 16
+
+class ServoBank:
+    def __init__(self, i2c_device, channels=CHANNELS):
+        #i2c_device: the pca9685's adafruit_bus_device I2CDevice (pca.i2c_device), or anything with
+        #the same context manager and write(buffer, start=0, end=None)
+        self.i2c_device = i2c_device
+        self.channels = channels
+        self._off = [0] * channels #0 is no pulse at all, same as the chip after a reset
+        self._buffer = bytearray(1 + 4 * channels)
+        self._first = channels
+        self._last = -1
+        self.writes = 0
+
+    def set_count(self, channel, off):
+        #off count 0-4095, returns True if the channel changed
+        if not 0 <= channel < self.channels or off == self._off[channel]:
+            return False
+        self._off[channel] = off
+        if channel < self._first:
+            self._first = channel
+        if channel > self._last:
+            self._last = channel
+        return True
+
+    def flush(self):
+        #one write covering the first to the last changed channel, channels in between get
+        #their current counts again. returns True if anything was written
+        if self._last < 0:
+            return False
+        buffer = self._buffer
+        buffer[0] = LED0_ON_L + 4 * self._first
+        index = 1
+        for channel in range(self._first, self._last + 1):
+            off = self._off[channel]
+            buffer[index] = 0 #pulse starts at the beginning of the period
+            buffer[index + 1] = 0
+            buffer[index + 2] = off & 0xFF
+            buffer[index + 3] = off >> 8
+            index += 4
+        with self.i2c_device as i2c:
+            i2c.write(buffer, end=index)
+        self._first = self.channels
+        self._last = -1
+        self.writes += 1
+        return True
@@ -0,0 +1,92 @@
+import json
+from array import array
+#servo targets, calibration and the control tick
+#the same file is in micropython_version and circuitpython_version, keep them in sync
+#
+#received angles only set a target. tick() runs at a fixed rate and moves every servo towards
+#its target by at most max_speed degrees per second, so the arm moves smoothly even when the
+#computer sends at a low rate. positions are fixed point (1/256 of a degree) and every channel
+#has its own angle -> output table made once from the calibration file, so a tick does no
+#float maths
+#
+#calibration file (json), every key is optional:
+#   {"min_pulse": 586, "max_pulse": 2540, "max_speed": 400,
+#    "channels": {"3": {"min_pulse": 600, "max_pulse": 2400, "reverse": true}}}
+#pulses are in microseconds for 0 and 180 degrees, max_speed is degrees per second (0 for no
+#limit), "channels" overrides any of them for one channel by its index
+
+FRACTION_BITS = 8
+HALF = 1 << (FRACTION_BITS - 1)
+MAX_ANGLE = 180
+NO_ANGLE = 0xFF #angles only go to 180, so this means no target yet
+
+DEFAULT_CALIBRATION = {'min_pulse': 586, 'max_pulse': 2540, 'max_speed': 400, 'reverse': False}
+
+def load_calibration(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except OSError:
+        print('No calibration file {}, using the default servo range'.format(path))
+    except ValueError as e:
+        print('Bad calibration file {}: {}'.format(path, e))
+    return {}
+
+def channel_calibration(calibration, channel):
+    settings = {}
+    for key in DEFAULT_CALIBRATION:
+        settings[key] = calibration.get(key, DEFAULT_CALIBRATION[key])
+    settings.update(calibration.get('channels', {}).get(str(channel), {}))
+    return settings
+
+class ServoController:
+    def __init__(self, channels, pulse_to_output, write, calibration=None, rate_hz=100):
+        #pulse_to_output(pulse in microseconds) -> the value write(channel, value) takes (pwm duty,
+        #pca9685 count, ...), only used to build the tables
+        self.channels = channels
+        self.write = write
+        self.tables = []
+        self.steps = [] #most a channel can move in one tick (1/256 degree), 0 for no limit
+        for channel in range(channels):
+            settings = channel_calibration(calibration or {}, channel)
+            min_pulse, max_pulse = settings['min_pulse'], settings['max_pulse']
+            if settings['reverse']:
+                min_pulse, max_pulse = max_pulse, min_pulse
+            self.tables.append(array('H', [pulse_to_output(min_pulse + (max_pulse - min_pulse) * angle / MAX_ANGLE)
+                                           for angle in range(MAX_ANGLE + 1)]))
+            self.steps.append(int(settings['max_speed'] * (1 << FRACTION_BITS) / rate_hz))
+        self.targets = bytearray([NO_ANGLE] * channels)
+        self.written = bytearray([NO_ANGLE] * channels) #angle each channel was last written at
+        self.positions = [0] * channels
+
+    def set_target(self, channel, angle):
+        if not 0 <= channel < self.channels or not 0 <= angle <= MAX_ANGLE:
+            return
+        if self.targets[channel] == NO_ANGLE: #we don't know where the servo is, go straight there
+            self.positions[channel] = angle << FRACTION_BITS
+        self.targets[channel] = angle
+
+    def tick(self):
+        #one control step, returns True if any channel was written
+        changed = False
+        for channel in range(self.channels):
+            target = self.targets[channel]
+            if target == NO_ANGLE:
+                continue
+            goal = target << FRACTION_BITS
+            position = self.positions[channel]
+            if position != goal:
+                step = self.steps[channel]
+                if step and goal - position > step:
+                    position += step
+                elif step and position - goal > step:
+                    position -= step
+                else:
+                    position = goal
+                self.positions[channel] = position
+            angle = (position + HALF) >> FRACTION_BITS
+            if angle != self.written[channel]:
+                self.written[channel] = angle
+                self.write(channel, self.tables[channel][angle])
+                changed = True
+        return changed
@@ -2,10 +2,12 @@ import board
 import busio
 import time
 import microcontroller
-from adafruit_motor import servo
 from adafruit_pca9685 import PCA9685
+from pca9685_bank import ServoBank
+from servo_control import ServoController, load_calibration
 from adafruit_ble import BLERadio
-from adafruit_ble.uuid import UUID
+from adafruit_ble.uuid import UUID, VendorUUID
+from adafruit_ble.characteristics.stream import StreamIn
 from adafruit_ble.advertising.standard import ProvideServicesAdvertisement
 from adafruit_ble.services.nordic import UARTService
 import adafruit_ble
@@ -18,8 +20,15 @@ DEVICE_NAME = "ESP-32 S3"
 CHANNELS = 16 
 FREQUENCY = 50
 PCA_ADDRESS = 0x43 #0x43 or 0x60
-MIN_PULSE = 586
-MAX_PULSE = 2540 #pulses in microseconds
+#servo ranges and speed limits come from the calibration file (see servo_control.py, copy
+#esp32_code/calibration.json onto the board), received angles are targets the control tick
+#moves the servos towards
+CALIBRATION_FILE = "calibration.json"
+CONTROL_RATE_HZ = 100
+#the client packs several frames into one write up to the mtu (244 byte payload at mtu 247)
+#and writes without response, so a few writes can land before we read them
+RX_BUFFER_SIZE = 512
+VERBOSE = False #print every packet, slows handling down
 
 #uncomment these if line 42 doesn't work to be used in line 44-46
 # UART_SERVICE_UUID = UUID("6E400001-B5A3-F393-E0A9-E50E24DCCA9E")
@@ -29,17 +38,29 @@ MAX_PULSE = 2540 #pulses in microseconds
 #initialise i2c and pca objects
 i2c = busio.I2C(microcontroller.pin.GPIO5, microcontroller.pin.GPIO4)
 pca = PCA9685(i2c, address=PCA_ADDRESS)
-pca.frequency = FREQUENCY
+pca.frequency = FREQUENCY #also turns on register auto increment, which the burst writes rely on
 
 #initialise servos, <-- if ur testing full hand, u might need to adjust the initialisation of the servos
 #in the correct order, either physically or hardcode it below
-servos = []
-for i in range(16):
-    servos.append(servo.Servo(pca.channels[i], min_pulse=MIN_PULSE, max_pulse=MAX_PULSE))
+#each control tick sets the counts of the servos that moved on the bank and they go out in one
+#i2c write on flush() (see pca9685_bank.py), pca.frequency reads back the frequency the chip
+#actually runs at
+servo_bank = ServoBank(pca.i2c_device, channels=CHANNELS)
+pwm_frequency = pca.frequency
+
+def pulse_to_count(pulse_us):
+    return round(pulse_us * pwm_frequency * 4096 / 1000000)
+
+controller = ServoController(CHANNELS, pulse_to_count, servo_bank.set_count,
+                             load_calibration(CALIBRATION_FILE), CONTROL_RATE_HZ)
 
 #bluetooth server shit
+class AngleUARTService(UARTService):
+    #nordic uart with a bigger rx buffer than the library's 64 bytes, rx takes writes with or without response
+    _server_rx = StreamIn(uuid=VendorUUID("6E400002-B5A3-F393-E0A9-E50E24DCCA9E"), timeout=1.0, buffer_size=RX_BUFFER_SIZE)
+
 ble = BLERadio()
-uart_service = UARTService() #should be the same by default, if not, use the variable below instead:
+uart_service = AngleUARTService() #should be the same by default, if not, use the variable below instead:
 
 # uart_service = UARTService(service_uuid=UART_SERVICE_UUID, 
 #                            rx_uuid=UART_RX_CHAR_UUID, 
@@ -49,12 +70,71 @@ advertisement = ProvideServicesAdvertisement(uart_service)
 advertisement.complete_name = DEVICE_NAME
 
 def set_servo_angle(servo_index, angle):
-    if 0 <= servo_index < len(servos):
-        servos[servo_index].angle = angle
-        time.sleep(0.1)
-
-def handle_received_data(data):
+    #the servo gets there over the next control ticks
+    controller.set_target(servo_index, angle)
+
+def control_tick():
+    if controller.tick():
+        servo_bank.flush()
+
+#binary angle frames, same layout as Computer_Code/src_code/angle_protocol.py:
+#header (0x80 | version << 4 | flags), sequence number, channel mask (2 bytes, little endian),
+#trace id (2 bytes, little endian) if FLAG_TRACE is set, one byte per channel in the mask,
+#then a checksum byte if FLAG_CHECKSUM is set
+#traced frames get an ack on tx: b'K', trace id (2 bytes), microseconds to set the servo targets (2 bytes)
+#frames usually only carry the channels that changed, FLAG_KEYFRAME ones carry all of them so
+#we catch up after a lost packet. the control tick only writes servos that moved
+PROTOCOL_VERSION = 1
+FLAG_CHECKSUM = 0x01
+FLAG_TRACE = 0x02
+FLAG_KEYFRAME = 0x04
+
+def decode_frame(data, offset=0):
+    #returns (channel mask, offset of the first angle, frame length), or None if the frame is bad
+    if len(data) - offset < 4 or not data[offset] & 0x80 or (data[offset] >> 4) & 0x07 != PROTOCOL_VERSION:
+        return None
+    mask = data[offset + 2] | (data[offset + 3] << 8)
+    count = 0
+    for channel in range(CHANNELS):
+        count += (mask >> channel) & 1
+    trace = 2 if data[offset] & FLAG_TRACE else 0
+    length = 4 + trace + count + (data[offset] & FLAG_CHECKSUM)
+    if len(data) - offset < length:
+        return None
+    if data[offset] & FLAG_CHECKSUM and sum(data[offset:offset + length - 1]) & 0xFF != data[offset + length - 1]:
+        return None
+    return mask, offset + 4 + trace, length
+
+def send_ack(data, offset, received_ns):
+    #latency trace ack for the frame at offset, time is from reading it to now (targets set)
+    actuation_us = min((time.monotonic_ns() - received_ns) // 1000, 0xFFFF)
+    uart_service.write(bytes((0x4B, data[offset + 4], data[offset + 5], actuation_us & 0xFF, actuation_us >> 8)))
+
+def handle_binary_data(data, received_ns=0):
+    #a single read can hold more than one frame, apply them in order
+    offset = 0
+    while offset < len(data):
+        frame = decode_frame(data, offset)
+        if frame is None:
+            print(f'Bad angle frame: {bytes(data[offset:])}')
+            break
+        mask, angle_offset, length = frame
+        for channel in range(CHANNELS):
+            if (mask >> channel) & 1:
+                set_servo_angle(channel, data[angle_offset])
+                angle_offset += 1
+        if data[offset] & FLAG_TRACE:
+            send_ack(data, offset, received_ns)
+        offset += length
+
+def handle_received_data(data, received_ns=0):
+    if data and data[0] & 0x80: #binary frame
+        handle_binary_data(data, received_ns)
+        return
+    #ascii fallback, frames end in a newline and a read can hold several, the newest wins
     try:
+        lines = [line for line in data.decode().split('\n') if line.strip()]
+        data = lines[-1].strip() if lines else ''
         angle_list = [int(angle.strip()) for angle in data.split(',')]
         if angle_list:
             #you might need to adjust this part of the loop if you change the
@@ -64,7 +144,7 @@ def handle_received_data(data):
             for i, angle in enumerate(angle_list):
                 if i < CHANNELS: 
                     set_servo_angle(i, angle)
-    except ValueError as e:
+    except (ValueError, UnicodeError) as e:
         print(f'Error processing received data: {data} - Error is {str(e)}')
 
 def send_shutdown_signal(connection):
@@ -91,14 +171,25 @@ def start_connection():
                     was_connected = True
                 uart_service.reset_input_buffer()
                 
-                #while we are connected
+                #while we are connected, no sleep so a packet is handled as soon as it's in and
+                #the control tick runs on time. read() with no size waits for the uart timeout,
+                #so only ask for what's there
+                tick_ns = 1000000000 // CONTROL_RATE_HZ
+                next_tick = time.monotonic_ns()
                 while connection.connected:
-                    if uart_service.in_waiting:
-                        received_data = uart_service.read().decode().strip()
-                        print(f"Received: {received_data}")
-                        handle_received_data(received_data)
-                    
-                    time.sleep(0.1) #read every 0.1 seconds
+                    now = time.monotonic_ns()
+                    if now >= next_tick:
+                        control_tick()
+                        next_tick += tick_ns
+                        if next_tick < now: #fell behind, don't try to catch up
+                            next_tick = now + tick_ns
+                    waiting = uart_service.in_waiting
+                    if waiting:
+                        received_ns = time.monotonic_ns()
+                        received_data = uart_service.read(waiting)
+                        if VERBOSE:
+                            print(f"Received: {received_data}")
+                        handle_received_data(received_data, received_ns)
                 
                 print("Disconnected")
             
@@ -1,22 +1,46 @@
 from bluetooth import * #for bluetooth.UUID() and FLAGS
 from ble_advertising import advertising_payload
 from micropython import const
+import micropython
 import utime
+import machine
 from machine import Pin, PWM
+from servo_control import ServoController, load_calibration
 
 pwm_pin = []
 pin_numbers = [14]
 frequency = 50
 
+#received angles are targets, the control tick moves the servos towards them at a fixed rate
+#under the speed limit and with each servo's range from the calibration file (see servo_control.py,
+#copy esp32_code/calibration.json onto the board)
+CONTROL_RATE_HZ = const(100)
+CALIBRATION_FILE = 'calibration.json'
+controller = None
+
+#printing every packet costs more than handling it, only for debugging
+LOG = False
+
+#receiving: the irq only copies the write into a buffer made at start up and schedules
+#_process_received, decoding and setting the targets happen there outside the irq. the binary
+#path doesn't allocate per packet (ascii still does, it's only the fallback)
+
 #constants for bluetooth events
 #alerts-------------------------
 _IRQ_CENTRAL_CONNECT = const(1) #alert for device connected
 _IRQ_CENTRAL_DISCONNECT = const(2) #alert for device disconnect
 _IRQ_GATTS_WRITE = const(3) #alert for receiving data
 
+_FLAG_WRITE_NO_RESPONSE = const(0x0004) #not exported by every port's bluetooth module
+
+#the client packs several frames into one write up to the mtu (244 byte payload at mtu 247)
+#and writes without response, so a few writes can land before we read them
+MTU = const(247)
+RX_BUFFER_SIZE = const(512)
+
 #constants for UART services
 _UART_UUID = UUID("6E400001-B5A3-F393-E0A9-E50E24DCCA9E") #service Identifier for bluetooth on device (think of it like the address for a home)
-_UART_RX = (UUID("6E400002-B5A3-F393-E0A9-E50E24DCCA9E"), FLAG_WRITE) #use write for rx (receiver) tells client you can write
+_UART_RX = (UUID("6E400002-B5A3-F393-E0A9-E50E24DCCA9E"), FLAG_WRITE | _FLAG_WRITE_NO_RESPONSE) #use write for rx (receiver) tells client you can write, with or without a response
 _UART_TX = (UUID("6E400003-B5A3-F393-E0A9-E50E24DCCA9E"), FLAG_NOTIFY) #use notify for tx (transmit), tells client there is a message for them
 _UART_SERVICE = (_UART_UUID, (_UART_TX, _UART_RX)) #order of tuple does not matter
 
@@ -27,32 +51,96 @@ def servo_init(pin_num, freaqy):
         pwm.freq(freaqy)
         pwm_pin.append(pwm)
         
+def write_duty(servo_index, duty):
+    #called by the control tick with a duty from the servo's calibration table
+    if servo_index < len(pwm_pin):
+        pwm_pin[servo_index].duty_u16(duty)
+#         print('Setting servo {} to duty {}'.format(servo_index, duty)) debugging
+
+def pulse_to_duty(pulse_us):
+    return int(pulse_us * frequency * 65535 / 1000000)
+
 def set_servo_angle(servo_index, angle):
-    if 0 <= servo_index < len(pwm_pin):
-        try:
-            d = map_angle_to_duty(angle)
-            pwm_pin[servo_index].duty(d)
-#         print('Setting servo {} to angle {} (duty {})'.format(servo_index, angle, dutyy)) debugging
-        except ValueError as e:
-            pass
-        dutyy = map_angle_to_duty(angle)
-        pwm_pin[servo_index].duty(dutyy)
+    #the servo gets there over the next control ticks
+    controller.set_target(servo_index, angle)
         
-def map_angle_to_duty(angle):
-    duty = int(((angle - 0) * (130 - 30) / (180 - 0)) + 30)
-#     print('Duty is: {} from angle {}'.format(duty, angle))
-    return duty
+#binary angle frames, same layout as Computer_Code/src_code/angle_protocol.py:
+#header (0x80 | version << 4 | flags), sequence number, channel mask (2 bytes, little endian),
+#trace id (2 bytes, little endian) if FLAG_TRACE is set, one byte per channel in the mask,
+#then a checksum byte if FLAG_CHECKSUM is set
+#traced frames get an ack on tx: b'K', trace id (2 bytes), microseconds to set the servo targets (2 bytes)
+#frames usually only carry the channels that changed, FLAG_KEYFRAME ones carry all of them so
+#we catch up after a lost packet. the control tick only writes servos that moved
+PROTOCOL_VERSION = const(1)
+FLAG_CHECKSUM = const(0x01)
+FLAG_TRACE = const(0x02)
+FLAG_KEYFRAME = const(0x04)
+MAX_CHANNELS = const(16)
+
+def frame_length(data, offset, end):
+    #length of the frame at offset if it is whole and its checksum is right, otherwise 0
+    #(an int rather than a tuple so decoding doesn't allocate)
+    if end - offset < 4 or not data[offset] & 0x80 or (data[offset] >> 4) & 0x07 != PROTOCOL_VERSION:
+        return 0
+    mask = data[offset + 2] | (data[offset + 3] << 8)
+    count = 0
+    while mask:
+        count += mask & 1
+        mask >>= 1
+    length = 4 + (2 if data[offset] & FLAG_TRACE else 0) + count + (data[offset] & FLAG_CHECKSUM)
+    if end - offset < length:
+        return 0
+    if data[offset] & FLAG_CHECKSUM:
+        total = 0
+        for i in range(offset, offset + length - 1):
+            total += data[i]
+        if total & 0xFF != data[offset + length - 1]:
+            return 0
+    return length
+
+def apply_binary_frames(data, end=-1, ack=None):
+    #a single write can hold more than one frame, apply them in order
+    #data[:end] holds the frames (all of data if end is -1)
+    #ack(trace id) is called after the targets of a traced frame are set
+    if end < 0:
+        end = len(data)
+    offset = 0
+    while offset < end:
+        length = frame_length(data, offset, end)
+        if not length:
+            if LOG:
+                print('Bad angle frame: {}'.format(bytes(data[offset:end])))
+            return
+        mask = data[offset + 2] | (data[offset + 3] << 8)
+        angle_offset = offset + (6 if data[offset] & FLAG_TRACE else 4)
+        for channel in range(MAX_CHANNELS):
+            if (mask >> channel) & 1:
+                set_servo_angle(channel, data[angle_offset])
+                angle_offset += 1
+        if ack and data[offset] & FLAG_TRACE:
+            ack(data[offset + 4] | (data[offset + 5] << 8))
+        offset += length
 
 class BLEServer:
     def __init__(self, ble, name="ESP-32 S3"):
         self._ble = ble #BLE object from main thread
         self._ble.active(True) #turning on bluetooth in radio chip
+        self._ble.config(mtu=MTU) #mtu we ask for, the client can still settle on less
         self._ble.irq(self._handle_irq_event) #sets processes/handle blocks to deal with events
         ((self._tx_handle, self._rx_handle),) = self._ble.gatts_register_services((_UART_SERVICE,)) #rego the services
-        self._ble.gatts_set_buffer(self._rx_handle, 64, False) #set buffer size on the bluetooth stack level, do not append (we have max 63 chars (1 byte each))
+        self._ble.gatts_set_buffer(self._rx_handle, RX_BUFFER_SIZE, True) #set buffer size on the bluetooth stack level, append so back to back writes aren't overwritten before we read them
         self._connected_device = None #we are guaranteed only one device will be connected so we don't need a list
         self._is_connected = False #flag
-        self._receiving_buffer = bytearray() #buffer for actual program storage not bluetooth
+        #two buffers made once: the irq copies writes into _rx_buffer, _process_received swaps
+        #it with _work_buffer and hands that to the handler, so nothing is allocated per packet
+        self._rx_buffer = bytearray(RX_BUFFER_SIZE)
+        self._work_buffer = bytearray(RX_BUFFER_SIZE)
+        self._rx_length = 0
+        self._scheduled = False
+        self._process_ref = self._process_received #bound once, making it in the irq would allocate
+        self.overruns = 0 #times the handler fell behind and older data was thrown away
+        self._received_us = 0 #when the last write came in, for latency acks
+        self._ack = bytearray(5)
         self._handler = None
         self._payload = advertising_payload(name=name) #name to advertise, make sure client side is looking for the same name
         self._advertise() #start advertising
@@ -93,37 +181,62 @@ class BLEServer:
                 return
             
             if attr_handle == self._rx_handle: #if attribute read matches what was written to rx on client
-                received_data = self._ble.gatts_read(self._rx_handle) #decode (in byte form by default)
-                print('Received data: {}'.format(received_data.decode())) #for debugging (might decode using utf-8)
-                self._receiving_buffer += received_data #add byte form to buffer
-                if self._handler: #if handler is set then call it to handle the received data
-                    self._handler() #hypothetically should be handling the received data
+                self._received_us = utime.ticks_us()
+                received_data = self._ble.gatts_read(self._rx_handle) #in byte form by default
+                if LOG:
+                    print('Received data: {}'.format(received_data)) #for debugging
+                size = len(received_data)
+                if self._rx_length + size > RX_BUFFER_SIZE: #handler fell behind, the old angles are stale anyway
+                    self._rx_length = 0
+                    self.overruns += 1
+                if size <= RX_BUFFER_SIZE:
+                    self._rx_buffer[self._rx_length:self._rx_length + size] = received_data
+                    self._rx_length += size
+                if not self._scheduled: #handle it outside the irq
+                    self._scheduled = True
+                    try:
+                        micropython.schedule(self._process_ref, None)
+                    except RuntimeError: #schedule queue full, the next write schedules it again
+                        self._scheduled = False
+
+    def _process_received(self, _):
+        #runs from the scheduler, not the irq
+        state = machine.disable_irq()
+        data, length = self._rx_buffer, self._rx_length
+        self._rx_buffer, self._work_buffer = self._work_buffer, data
+        self._rx_length = 0
+        self._scheduled = False
+        machine.enable_irq(state)
+        if self._handler and length: #if handler is set then call it to handle the received data
+            self._handler(data, length)
 
     def _advertise(self, interval_us=500000): #advertise every 0.5 seconds (microseconds (us))
         self._ble.gap_advertise(interval_us, adv_data=self._payload)
         print('Advertising...')
     
     #scalable handler function, however we are only receiving data and processing it so we only have one handler (process received data)
+    #handler(data, length) gets the raw bytes in data[:length], a binary frame or ascii text.
+    #data is reused for later writes so don't keep it around
     def set_handler(self, handler):
         self._handler = handler
         
-#     def check_for_data(self):
-#         return len(self._receiving_buffer)
-    
-    def read_received_data(self):
-        data = self._receiving_buffer
-        self._receiving_buffer = bytearray() #reset the buffer
-        try:
-            return data.decode().strip()
-        except UnicodeError:
-            print('Error in decoding data: {}'.format(data))
-            return "" #need to double check, this might be a bug but for now its not cos we never really use it yet
-        
     def disconnect_device(self, keyboard_interrupt=False):
         self._is_connected = False
         self._connected_device = None
         self._keyboard_interrupt = keyboard_interrupt
         
+    def send_ack(self, trace_id):
+        #latency trace ack, time is from the write arriving to now (servos set)
+        if self._is_connected:
+            actuation_us = min(utime.ticks_diff(utime.ticks_us(), self._received_us), 0xFFFF)
+            ack = self._ack
+            ack[0] = 0x4B #'K'
+            ack[1] = trace_id & 0xFF
+            ack[2] = trace_id >> 8
+            ack[3] = actuation_us & 0xFF
+            ack[4] = actuation_us >> 8
+            self._ble.gatts_notify(self._connected_device, self._tx_handle, ack)
+
     def send_shutdown_signal(self):
         if self._is_connected: #if device is still connected
             s = b'cunt'
@@ -137,13 +250,25 @@ def countdown():
         utime.sleep_ms(1000)
 
 def start_connection():
+    global controller
     ble = BLE()
     server = BLEServer(ble)
     
     servo_init(pin_numbers, frequency)
+    controller = ServoController(len(pin_numbers), pulse_to_duty, write_duty,
+                                 load_calibration(CALIBRATION_FILE), CONTROL_RATE_HZ)
     
-    def handle_received():
-        message = server.read_received_data()
+    def handle_received(data, length):
+        if data[0] & 0x80: #binary frame
+            apply_binary_frames(data, length, server.send_ack)
+            return
+        #ascii fallback, frames end in a newline and a read can hold several, the newest wins
+        try:
+            lines = [line for line in bytes(data[:length]).decode().split('\n') if line.strip()]
+            message = lines[-1].strip() if lines else ""
+        except UnicodeError:
+            print('Error in decoding data: {}'.format(bytes(data[:length])))
+            message = ""
 #         print('the message is: {}'.format(message))
         if message:
             try:
@@ -155,15 +280,22 @@ def start_connection():
 #                             print('{} angle set ({})'.format((i + 1), angle))
             except ValueError as e:
                 print('Error processing received data: {} - Error is {}'.format(message, str(e)))
-        else:
+        elif LOG:
             print('No data received')
     
     server.set_handler(handle_received)
     
+    tick_ms = 1000 // CONTROL_RATE_HZ
+    next_tick = utime.ticks_ms()
     try:
-        while True: #infinite loop for bluetooth connection
-            pass
-#             utime.sleep_ms(100)
+        while True: #infinite loop for bluetooth connection, one control tick per pass
+            controller.tick()
+            next_tick = utime.ticks_add(next_tick, tick_ms)
+            wait = utime.ticks_diff(next_tick, utime.ticks_ms())
+            if wait > 0:
+                utime.sleep_ms(wait) #idles instead of spinning, scheduled receives run in between
+            else: #fell behind, don't try to catch up
+                next_tick = utime.ticks_ms()
     except KeyboardInterrupt:
         print('Stopping...')
         server.send_shutdown_signal() #send to client to close
@@ -172,6 +304,8 @@ def start_connection():
         countdown() #letting client side properly terminate ('device was disconnected' should print inbetween this time as its in an async (implicit) function) 
     finally:
         #ble.active(False)
+        if server.overruns:
+            print('Receive buffer overran {} times'.format(server.overruns))
         print('Stopped!')
         
 if __name__ == '__main__':
@@ -0,0 +1,146 @@
+import os, sys, types
+#runs on the computer, not the board: python check_bluetooth_server.py
+#stands in for micropython's bluetooth, machine, micropython and utime modules and drives
+#bluetooth_server's receive path like the ble stack would: writes land in the irq, which only
+#copies them and schedules _process_received, then the scheduler runs it. checks that two
+#writes landing before the scheduler runs (several frames each) are all decoded in order, that
+#every traced frame is acked on tx, and that a frame cut short stops decoding without touching
+#the servos. the frames are made with the computer's encoder (Computer_Code/src_code/angle_protocol.py)
+#so this also checks the two sides still agree on the layout
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, '..', '..', 'Computer_Code', 'src_code'))
+
+#-----------------------------------------------------------------------------------#
+#                              micropython stand-ins
+#
+#-----------------------------------------------------------------------------------#
+scheduled = [] #(function, argument) waiting for the scheduler
+
+def schedule(function, argument):
+    scheduled.append((function, argument))
+
+def run_scheduled():
+    while scheduled:
+        function, argument = scheduled.pop(0)
+        function(argument)
+
+ticks = [0]
+
+def stub_modules():
+    bluetooth = types.ModuleType('bluetooth')
+    bluetooth.UUID = lambda value: value
+    bluetooth.FLAG_WRITE = 0x0008
+    bluetooth.FLAG_NOTIFY = 0x0010
+    bluetooth.__all__ = ['UUID', 'FLAG_WRITE', 'FLAG_NOTIFY']
+
+    ble_advertising = types.ModuleType('ble_advertising')
+    ble_advertising.advertising_payload = lambda name=None, **kwargs: (name or '').encode()
+
+    micropython = types.ModuleType('micropython')
+    micropython.const = lambda value: value
+    micropython.schedule = schedule
+
+    utime = types.ModuleType('utime')
+    utime.ticks_us = lambda: ticks[0]
+    utime.ticks_ms = lambda: ticks[0] // 1000
+    utime.ticks_diff = lambda a, b: a - b
+    utime.ticks_add = lambda a, b: a + b
+    utime.sleep_ms = lambda ms: None
+
+    machine = types.ModuleType('machine')
+    machine.Pin = machine.PWM = object
+    machine.disable_irq = lambda: 0
+    machine.enable_irq = lambda state: None
+
+    for module in (bluetooth, ble_advertising, micropython, utime, machine):
+        sys.modules[module.__name__] = module
+
+class FakeBLE:
+    #the parts of bluetooth.BLE the server uses, gatts_read hands back the last write
+    def __init__(self):
+        self.value = b''
+        self.notified = []
+        self.irq_handler = None
+
+    def active(self, state):
+        pass
+
+    def config(self, **kwargs):
+        pass
+
+    def irq(self, handler):
+        self.irq_handler = handler
+
+    def gatts_register_services(self, services):
+        return ((1, 2),) #tx, rx handles
+
+    def gatts_set_buffer(self, handle, size, append):
+        pass
+
+    def gap_advertise(self, interval_us, adv_data=None):
+        pass
+
+    def gatts_read(self, handle):
+        return self.value
+
+    def gatts_notify(self, conn_handle, handle, data):
+        self.notified.append(bytes(data))
+
+    def write(self, server, data):
+        #the client writes rx, the stack raises the irq
+        self.value = data
+        self.irq_handler(server_module._IRQ_GATTS_WRITE, (0, server._rx_handle))
+
+class TargetRecorder:
+    def __init__(self):
+        self.targets = []
+
+    def set_target(self, channel, angle):
+        self.targets.append((channel, angle))
+
+def main():
+    global server_module
+    stub_modules()
+    import bluetooth_server as server_module
+    import angle_protocol
+
+    ble = FakeBLE()
+    server = server_module.BLEServer(ble)
+    recorder = TargetRecorder()
+    server_module.controller = recorder
+    server.set_handler(lambda data, length: server_module.apply_binary_frames(data, length, server.send_ack))
+    ble.irq_handler(server_module._IRQ_CENTRAL_CONNECT, (0, 0, b''))
+
+    #two writes before the scheduler gets to run, the first with two frames, one of them traced
+    first = (angle_protocol.encode_frame([10, 20, 30], 1, trace_id=0x1234) +
+             angle_protocol.encode_frame([40], 2, channels=[5]))
+    second = angle_protocol.encode_frame([50, 60], 3, channels=[1, 7], trace_id=0x0102)
+    ticks[0] = 1000
+    ble.write(server, first)
+    ble.write(server, second)
+    assert len(scheduled) == 1, f'{len(scheduled)} callbacks scheduled for back to back writes'
+    assert not recorder.targets, 'angles were set inside the irq'
+    ticks[0] = 1250
+    run_scheduled()
+
+    expected = [(0, 10), (1, 20), (2, 30), (5, 40), (1, 50), (7, 60)]
+    assert recorder.targets == expected, f'targets {recorder.targets}, expected {expected}'
+    acks = [angle_protocol.decode_ack(ack) for ack in ble.notified]
+    assert [trace_id for trace_id, _ in acks] == [0x1234, 0x0102], f'acks {acks}'
+    assert acks[0][1] == 250, f'actuation {acks[0][1]} us'
+
+    #a frame cut short in a write stops decoding there, nothing past it is applied
+    recorder.targets.clear()
+    whole = angle_protocol.encode_frame([90], 4)
+    ble.write(server, whole + angle_protocol.encode_frame([91, 92], 5)[:-2])
+    run_scheduled()
+    assert recorder.targets == [(0, 90)], f'targets {recorder.targets} after a cut short frame'
+    assert server.overruns == 0
+
+    print(f'ok: {len(expected)} angles from 3 frames in 2 writes, {len(acks)} acks, cut short frame dropped')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())